@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Benchmarks of pyslurm's own performance, on synthetic inputs and without SLURM.
+
+Measures the cold start of `pyslurm.py --help` and of a single generation, the throughput of
+one call per input (sequential) and of batch mode for large numbers of inputs, with peak memory,
+and in-process timings of code detection on large inputs and of script rendering per code.
+
+Results are written as JSON and can be compared against a stored baseline:
+    benchmarks/run.py -o results.json
+    benchmarks/run.py --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYSLURM = os.path.join(ROOT, 'pyslurm', 'pyslurm.py')
+sys.path.insert(0, os.path.join(ROOT, 'pyslurm'))
+
+GENERATE = ['-c', 'saga', '-a', 'nn0000k', '--hours', '1', '-f']
+
+# Start-up targets (s): pyslurm.py is called from shell loops, so fixed costs add up
+TARGETS = {'startup.help': 0.05}
+
+
+def orca_input(atoms=3):
+    coords = [f'  C {i * 1.1:.4f} 0.0000 0.0000' for i in range(atoms)]
+    return '\n'.join(['# synthetic ORCA input', '! pbe def2-svp', '%pal nprocs 4 end', '* xyz 0 1'] + coords + ['*', ''])
+
+
+def gaussian_input(atoms=3):
+    coords = [f'C {i * 1.1:.4f} 0.0000 0.0000' for i in range(atoms)]
+    return '\n'.join(['%mem=4GB', '%chk=x.chk', '#p b3lyp/6-31g opt', '', 'synthetic Gaussian input', '', '0 1'] + coords + ['', ''])
+
+
+def mrchem_input(atoms=3):
+    coords = [f'    C {i * 1.1:.4f} 0.0 0.0' for i in range(atoms)]
+    return '\n'.join(['world_prec = 1.0e-4', 'Molecule {', '  $coords'] + coords + ['  $end', '}', 'WaveFunction {', '  method = pbe', '}', ''])
+
+
+INPUTS = {'orca': orca_input, 'gaussian': gaussian_input, 'mrchem': mrchem_input}
+
+
+def write_inputs(directory, n, atoms=3):
+    """Write n small inputs, cycling over the codes."""
+    os.makedirs(directory, exist_ok=True)
+    codes = sorted(INPUTS)
+    for i in range(n):
+        with open(os.path.join(directory, f'mol{i:06d}.inp'), 'w') as f:
+            f.write(INPUTS[codes[i % len(codes)]](atoms))
+
+
+def run(cmd, cwd):
+    """Run a command, returning wall time (s) and peak memory (MB) of it and its children."""
+    t0 = time.perf_counter()
+    p = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(p.pid, 0)
+    elapsed = time.perf_counter() - t0
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise RuntimeError(f'{" ".join(cmd)} failed (status {status})')
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def best_of(repeat, f):
+    times = [f() for _ in range(repeat)]
+    return min(times), statistics.median(times)
+
+
+def bench_startup(tmp, repeat):
+    results = {}
+    fastest, median = best_of(repeat, lambda: run([sys.executable, PYSLURM, '--help'], tmp)[0])
+    results['startup.help'] = {'value': median, 'min': fastest, 'unit': 's', 'better': 'lower'}
+
+    single = os.path.join(tmp, 'single')
+    write_inputs(single, 1)
+    fastest, median = best_of(repeat, lambda: run([sys.executable, PYSLURM, '-i', 'mol000000.inp'] + GENERATE, single)[0])
+    results['startup.generate'] = {'value': median, 'min': fastest, 'unit': 's', 'better': 'lower'}
+    return results
+
+
+def bench_sequential(tmp, n):
+    """One pyslurm.py call per input, as in shell loops."""
+    directory = os.path.join(tmp, f'sequential{n}')
+    write_inputs(directory, n)
+    t0, peak = time.perf_counter(), 0.0
+    for i in range(n):
+        peak = max(peak, run([sys.executable, PYSLURM, '-i', f'mol{i:06d}.inp'] + GENERATE, directory)[1])
+    elapsed = time.perf_counter() - t0
+    return {f'sequential.{n}.jobs_per_s': {'value': n / elapsed, 'unit': 'jobs/s', 'better': 'higher'},
+            f'sequential.{n}.peak_mb': {'value': peak, 'unit': 'MB', 'better': 'lower'}}
+
+
+def bench_batch(tmp, n, jobs):
+    directory = os.path.join(tmp, f'batch{n}')
+    write_inputs(directory, n)
+    results = {}
+    for j in sorted({1, jobs}):
+        elapsed, peak = run([sys.executable, PYSLURM, '-i', '*.inp', '--no-code-cache', '-j', str(j)] + GENERATE, directory)
+        results[f'batch.{n}.j{j}.jobs_per_s'] = {'value': n / elapsed, 'unit': 'jobs/s', 'better': 'higher'}
+        results[f'batch.{n}.j{j}.peak_mb'] = {'value': peak, 'unit': 'MB', 'better': 'lower'}
+    return results
+
+
+def bench_detection(tmp, atoms, repeat):
+    from detect import detect_code
+
+    results = {}
+    for code, make in sorted(INPUTS.items()):
+        path = os.path.join(tmp, f'large_{code}.inp')
+        with open(path, 'w') as f:
+            f.write(make(atoms))
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            assert detect_code(path) == code
+        results[f'detect.{code}.us'] = {'value': (time.perf_counter() - t0) / repeat * 1e6, 'unit': 'us', 'better': 'lower'}
+    return results
+
+
+def bench_rendering(tmp, repeat):
+    from config import Config
+    from jobs import GaussianJob, MRChemJob, ORCAJob
+
+    results = {}
+    for code, cls in [('gaussian', GaussianJob), ('mrchem', MRChemJob), ('orca', ORCAJob)]:
+        config = Config(input=os.path.join(tmp, 'render.inp'), cluster='saga', account='nn0000k')
+        job = cls(config=config)
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            job.build_job()
+        results[f'render.{code}.us'] = {'value': (time.perf_counter() - t0) / repeat * 1e6, 'unit': 'us', 'better': 'lower'}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Regressions: results worse than the baseline by more than threshold (relative)."""
+    regressions = []
+    for name, r in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], r['value']
+        change = (new - old) / old if old else 0.0
+        worse = change > threshold if r['better'] == 'lower' else change < -threshold
+        print(f'{name:<34}{old:>12.4g}{new:>12.4g} {r["unit"]:<7}{change:>+8.1%}{"  REGRESSION" if worse else ""}')
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyslurm job generation.')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='Results file (default: benchmark.json).')
+    parser.add_argument('--baseline', type=str, metavar='FILE', help='Compare against a stored results file, exit 1 on regressions.')
+    parser.add_argument('--threshold', default=0.2, type=float, help='Relative change counted as a regression (default: 0.2).')
+    parser.add_argument('--sizes', default='1000,10000', help='Numbers of inputs for batch mode (default: 1000,10000).')
+    parser.add_argument('--sequential', default=100, type=int, metavar='N', help='Number of inputs generated one call at a time (default: 100).')
+    parser.add_argument('--jobs', default=os.cpu_count() or 1, type=int, help='Worker processes for the parallel batch run.')
+    parser.add_argument('--repeat', default=10, type=int, help='Repetitions of the startup benchmarks.')
+    parser.add_argument('--atoms', default=20000, type=int, help='Atoms in the large inputs used for code detection.')
+    parser.add_argument('--quick', action='store_true', help='Small sizes only (1000 inputs, 20 sequential calls).')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.sizes, args.sequential, args.repeat = '1000', 20, 5
+
+    tmp = tempfile.mkdtemp(prefix='pyslurm_bench_')
+    # Keep user and site environment files out of the measurements
+    os.environ['PYSLURM_SITE_ENVIRONMENTS'] = os.path.join(tmp, 'none.json')
+    os.environ['PYSLURM_USER_ENVIRONMENTS'] = os.path.join(tmp, 'none.json')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tmp, 'cache')
+    os.environ['XDG_CONFIG_HOME'] = os.path.join(tmp, 'config')
+
+    results = {}
+    try:
+        results.update(bench_startup(tmp, args.repeat))
+        if args.sequential:
+            results.update(bench_sequential(tmp, args.sequential))
+        for n in [int(s) for s in args.sizes.split(',') if s]:
+            results.update(bench_batch(tmp, n, args.jobs))
+        results.update(bench_detection(tmp, args.atoms, 100))
+        results.update(bench_rendering(tmp, 1000))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    meta = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'python': platform.python_version(),
+            'machine': platform.node(), 'cpus': os.cpu_count()}
+    with open(args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    for name, r in sorted(results.items()):
+        print(f'{name:<34}{r["value"]:>12.4g} {r["unit"]}')
+    print(f'Results written to {args.output}')
+
+    missed = [name for name, limit in TARGETS.items() if name in results and results[name]['value'] > limit]
+    for name in missed:
+        print(f'{name} over its target of {TARGETS[name]} s')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print(f'\nCompared to {args.baseline}:')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.threshold:.0%}')
+            return 1
+    return 1 if missed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
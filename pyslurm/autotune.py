@@ -0,0 +1,246 @@
+import math
+import os
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from detect import UnknownJonError, detect_code
+
+# Rough cost of a basis set relative to a double zeta basis
+BASIS_ZETA = [('qz', 4.0), ('5z', 5.0), ('tz', 3.0), ('dz', 2.0), ('sv', 2.0), ('6-311', 3.0), ('6-31', 2.0), ('sto-3g', 1.0)]
+
+# Safety margins on top of the predictions, and lower bounds
+TIME_MARGIN = 1.5
+MEMORY_MARGIN = 1.3
+MIN_SECONDS = 10 * 60
+MIN_MEMORY_GB = 1
+
+# Fits need at least this many finished jobs per code
+MIN_SAMPLES = 3
+
+MEMORY_UNITS = {'K': 1 / 1024**2, 'M': 1 / 1024, 'G': 1.0, 'T': 1024.0}
+
+
+def count_block(lines, start, end):
+    """Count the non-blank lines after the first line matching start and before the next line matching end."""
+    n, inside = 0, False
+    for line in lines:
+        s = line.strip().lower().replace(' ', '')
+        if not inside:
+            inside = start(s)
+        elif end(s):
+            break
+        elif s:
+            n += 1
+    return n
+
+
+def basis_zeta(keywords):
+    for key, zeta in BASIS_ZETA:
+        if key in keywords:
+            return zeta
+    return 2.0
+
+
+def input_features(path, code=None):
+    """Size of the calculation in an input file: number of atoms, basis set zeta level and, for MRChem,
+    the number of significant digits of world_prec. Returns a dict, or None if no atoms were found."""
+    code = code if code is not None else detect_code(path)
+    try:
+        with open(path, errors='replace') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    features = {'code': code, 'atoms': 0, 'zeta': 2.0, 'digits': 0.0}
+    if code == 'orca':
+        features['atoms'] = count_block(lines, lambda s: s.startswith('*xyz'), lambda s: s.startswith('*'))
+        xyzfile = [l.split() for l in lines if l.strip().lower().replace(' ', '').startswith('*xyzfile')]
+        if xyzfile and len(xyzfile[0]) > 1:
+            try:
+                with open(Path(path).parent / xyzfile[0][-1]) as f:
+                    features['atoms'] = int(f.readline())
+            except (OSError, ValueError):
+                pass
+        features['zeta'] = basis_zeta(' '.join(l.lower() for l in lines if l.strip().startswith('!')))
+    elif code == 'gaussian':
+        # Route section, title and charge/multiplicity are separated by blank lines, atoms follow
+        sections, current = [], []
+        for line in lines:
+            if line.strip().startswith('%') and not sections and not current:
+                continue
+            if line.strip():
+                current.append(line)
+            elif current:
+                sections.append(current)
+                current = []
+        if current:
+            sections.append(current)
+        if len(sections) >= 3:
+            features['atoms'] = len(sections[2]) - 1
+            features['zeta'] = basis_zeta(' '.join(sections[0]).lower())
+    elif code == 'mrchem':
+        features['atoms'] = count_block(lines, lambda s: s.startswith('$coords'), lambda s: s.startswith('$end'))
+        for line in lines:
+            m = re.search(r'world_prec"?\s*[=:]\s*([0-9.eE+-]+)', line)
+            if m:
+                try:
+                    features['digits'] = -math.log10(float(m.group(1)))
+                except ValueError:
+                    pass
+                break
+
+    return features if features['atoms'] > 0 else None
+
+
+def size(features):
+    """Single size measure the fits are made against."""
+    if features['code'] == 'mrchem':
+        return features['atoms'] * max(features['digits'], 1.0)
+    return features['atoms'] * features['zeta']
+
+
+def parse_elapsed(s):
+    """Seconds from a SLURM duration ([D-]HH:MM:SS or MM:SS)."""
+    days = 0
+    if '-' in s:
+        d, s = s.split('-', 1)
+        days = int(d)
+    parts = [float(p) for p in s.split(':')]
+    while len(parts) < 3:
+        parts.insert(0, 0.0)
+    return days * 86400 + parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def parse_memory(s):
+    """GB from a sacct memory value such as 1234K, 2.5G or 4Gn."""
+    m = re.match(r'([0-9.]+)([KMGT])?', s)
+    if not m:
+        return None
+    return float(m.group(1)) * MEMORY_UNITS[m.group(2) or 'K']
+
+
+def read_sacct(path):
+    """Read a `sacct --parsable[2] -o JobID,JobName,State,Elapsed,NCPUS,MaxRSS[,NTasks]` dump (any column
+    order, header required). Step lines are merged into their job. Returns completed jobs as dicts with
+    name, seconds, cpus and maxrss (GB for the whole job). MaxRSS is that of the largest task of a step:
+    the batch step holds the whole process tree of the script (e.g. mpirun and ORCA) and is taken as is,
+    srun steps are scaled by their NTasks, if given."""
+    jobs = {}
+    with open(path) as f:
+        header = [h.strip().lower() for h in f.readline().rstrip('\n').rstrip('|').split('|')]
+        for line in f:
+            row = dict(zip(header, line.rstrip('\n').rstrip('|').split('|')))
+            if 'jobid' not in row:
+                continue
+            jobid, _, step = row['jobid'].partition('.')
+            job = jobs.setdefault(jobid, {'name': None, 'state': None, 'seconds': None, 'cpus': None, 'maxrss': 0.0})
+            if not step:
+                job['name'] = row.get('jobname')
+                job['state'] = row.get('state', '')
+                if row.get('elapsed'):
+                    job['seconds'] = parse_elapsed(row['elapsed'])
+                if row.get('ncpus'):
+                    job['cpus'] = int(row['ncpus'])
+            if row.get('maxrss'):
+                rss = parse_memory(row['maxrss']) or 0.0
+                if step and step not in ['batch', 'extern'] and row.get('ntasks', '').isdigit():
+                    rss *= int(row['ntasks'])
+                job['maxrss'] = max(job['maxrss'], rss)
+
+    return [j for j in jobs.values()
+            if j['name'] and j['state'].startswith('COMPLETED') and j['seconds'] and j['cpus']]
+
+
+def fit_power_law(xs, ys):
+    """Least squares fit of log(y) = a + b*log(x). Returns (a, b)."""
+    lx = [math.log(x) for x in xs]
+    ly = [math.log(y) for y in ys]
+    mx, my = sum(lx) / len(lx), sum(ly) / len(ly)
+    sxx = sum((x - mx)**2 for x in lx)
+    b = sum((x - mx) * (y - my) for x, y in zip(lx, ly)) / sxx if sxx > 0 else 0.0
+    return my - b * mx, b
+
+
+class ResourceModel:
+    """Per code power law fits of core-seconds and peak memory of the job against calculation size,
+    plus the core counts used by previous jobs of similar size."""
+    def __init__(self):
+        self.time = {}
+        self.memory = {}
+        self.cores = defaultdict(list)
+
+    @classmethod
+    def from_history(cls, history, inputs_dir=None, ext_inp='.inp'):
+        """Fit on the completed jobs in the sacct dump history, matching job names to the
+        input files <inputs_dir>/<name><ext_inp> (default: next to the dump)."""
+        model = cls()
+        inputs_dir = inputs_dir if inputs_dir is not None else os.path.dirname(history)
+        samples = defaultdict(list)
+        for job in read_sacct(history):
+            try:
+                features = input_features(os.path.join(inputs_dir, job['name'] + ext_inp))
+            except UnknownJonError:
+                continue
+            if features is None or features['code'] is None:
+                continue
+            samples[features['code']].append((size(features), job))
+
+        for code, points in samples.items():
+            model.cores[code] = sorted((s, job['cpus']) for s, job in points)
+            if len(points) < MIN_SAMPLES:
+                continue
+            model.time[code] = fit_power_law([s for s, _ in points], [job['seconds'] * job['cpus'] for _, job in points])
+            mem = [(s, job['maxrss']) for s, job in points if job['maxrss'] > 0]
+            if len(mem) >= MIN_SAMPLES:
+                model.memory[code] = fit_power_law([s for s, _ in mem], [m for _, m in mem])
+        return model
+
+    def predict(self, features):
+        """Predict cores, walltime (seconds) and memory of the job (GB) from the input features.
+        Returns None if there is no fit for the code."""
+        code = features['code']
+        if code not in self.time:
+            return None
+
+        s = size(features)
+        nearest = sorted(self.cores[code], key=lambda p: abs(math.log(p[0]) - math.log(s)))[:3]
+        cores = sorted(c for _, c in nearest)[len(nearest) // 2]
+
+        a, b = self.time[code]
+        seconds = math.exp(a) * s**b / cores
+        memory = None
+        if code in self.memory:
+            a, b = self.memory[code]
+            memory = math.exp(a) * s**b
+        return cores, seconds, memory
+
+
+def format_time(seconds):
+    """SLURM walltime, rounded up to 5 minutes."""
+    minutes = int(math.ceil(seconds / 300)) * 5
+    return f'{minutes // 1440}-{minutes // 60 % 24:02d}:{minutes % 60:02d}:00'
+
+
+def autotune(config, path, model, code=None):
+    """Set ntasks, walltime and total memory of config from the model prediction for the input at path,
+    with safety margins. Returns a description of the changes, or None if nothing could be predicted."""
+    features = input_features(path, code)
+    if features is None:
+        return None
+    prediction = model.predict(features)
+    if prediction is None:
+        return None
+
+    cores, seconds, memory = prediction
+    tasks = max(1, cores // int(config.cpus)) if config.hybrid else cores
+    config.ntasks = str(tasks)
+    config.timelimit = format_time(max(seconds * TIME_MARGIN, MIN_SECONDS))
+    changes = [f'ntasks={config.ntasks}', f'time={config.timelimit}']
+    if memory is not None:
+        config.memory = f'{max(MIN_MEMORY_GB, math.ceil(memory * MEMORY_MARGIN))}GB'
+        config.memtype = 'tot'
+        changes.append(f'mem={config.memory}')
+
+    config.build_config()
+    return f'{features["atoms"]} atoms: ' + ', '.join(changes)
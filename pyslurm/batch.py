@@ -0,0 +1,230 @@
+import glob
+import os
+from collections import Counter
+from pathlib import Path
+
+from detect import UnknownJonError, detect_code
+from jobs import Job, MRChemJob, GaussianJob, ORCAJob
+from layout import check_config, plan_config
+
+
+def is_batch(args):
+    """Batch mode is requested by a glob pattern as input or by an input list."""
+    return args.from_list is not None or (args.input is not None and glob.has_magic(args.input))
+
+
+def expand_inputs(pattern=None, from_list=None):
+    """Expand a glob pattern and/or a file listing one input per line.
+    Returns a list of unique input files in the order they were found."""
+    files = []
+    if pattern is not None:
+        files.extend(sorted(glob.glob(pattern)))
+    if from_list is not None:
+        with open(from_list) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    files.append(line)
+
+    seen = set()
+    unique = []
+    for f in files:
+        if f not in seen:
+            seen.add(f)
+            unique.append(f)
+    return unique
+
+
+def read_path_file(directory, stem, ext):
+    """Read the path stored in <directory>/<stem><ext> (e.g. the .orbitals files written by MRChemJob).
+    Returns None if the file does not exist or is empty."""
+    try:
+        with open(os.path.join(directory, stem + ext)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def plan_job_scratch(config, args, code):
+    """Scratch policy of --scratch, or of the environment of the cluster and code (default: shared).
+    Returns the node-local scratch requested in config (GB), or None for the shared scratch."""
+    from environment import get_environments
+    from scratch import plan_scratch
+
+    entry = get_environments().get(config.cluster, {}).get(code, {})
+    policy = args.scratch if args.scratch is not None else entry.get('scratch', 'shared')
+    size = args.scratch_size if args.scratch_size is not None else entry.get('scratch_size')
+    return plan_scratch(config, code, config.input + config.ext_inp, policy, size, args.disk)
+
+
+def make_job(config, args, code=None, init_orbs=None, init_check=None):
+    """Construct the job class matching the input of config. The code is read from the input
+    unless given, falling back to --code if it could not be determined."""
+    if code is None:
+        code = detect_code(config.input + config.ext_inp)
+    if code is None:
+        code = args.code
+
+    if args.layout or args.cores is not None:
+        plan_config(config, code, args.cores)
+    check_config(config)
+
+    # Array elements and farm tasks share one job, which stays on the shared scratch
+    scratch = None
+    if code in ['gaussian', 'orca', 'mrchem'] and not (args.array or args.farm):
+        scratch = plan_job_scratch(config, args, code)
+
+    requeue = args.max_restarts if args.requeue_on_timeout else None
+    staging = None
+    if args.parallel_staging or args.bcast or args.bcast_guess:
+        from staging import Staging
+        staging = Staging(workers=args.stage_workers, bcast=args.bcast, bcast_guess=args.bcast_guess)
+
+    if code == 'gaussian':
+        job = GaussianJob(config=config,
+                           dest=args.dest,
+                           template=args.template,
+                           staging=staging,
+                           instrument=args.instrument,
+                           requeue=requeue,
+                           local_scratch=scratch is not None,
+                           need_files=args.copy_to,
+                           save_files=args.copy_back)
+        if scratch is not None:
+            from scratch import GAUSSIAN_DISK_HEADROOM, gaussian_disk
+            from inputsync import SYNCED
+            with open(config.input + config.ext_inp) as f:
+                text = f.read()
+            job.stage_input(str(job.dest / SYNCED / job.inputfile), gaussian_disk(text, job.stem, int(scratch * GAUSSIAN_DISK_HEADROOM)))
+            job.job = job.build_job()
+        return job
+    elif code == 'orca':
+        return ORCAJob(config=config,
+                       dest=args.dest,
+                       template=args.template,
+                       staging=staging,
+                       instrument=args.instrument,
+                       requeue=requeue,
+                       local_scratch=scratch is not None,
+                       need_files=args.copy_to,
+                       save_files=args.copy_back)
+    elif code == 'mrchem':
+        return MRChemJob(config=config,
+                         dest=args.dest,
+                         template=args.template,
+                         staging=staging,
+                         instrument=args.instrument,
+                         requeue=requeue,
+                         local_scratch=scratch is not None,
+                         store_orbs=not args.rm_orb,
+                         store_chk=not args.rm_check,
+                         init_orbs=init_orbs if init_orbs is not None else args.guess_orb,
+                         init_check=init_check if init_check is not None else args.guess_check,
+                         need_files=args.copy_to,
+                         save_files=args.copy_back,
+                         json=args.json,
+                         version=args.version,
+                         orb_store=args.orb_store,
+                         orb_compress=args.orb_compress)
+    else:
+        return Job(config=config, dest=args.dest)
+
+
+def generate(path, template, args, code=None, model=None):
+    """Generate the job file for a single input from the configuration template. The code is
+    detected from the input unless already known, and resources are predicted by the model, if given.
+    Returns a tuple (jobfile, code, status, error, detected, report, digest) with status one of 'written',
+    'skipped' or 'failed', detected the code freshly detected from the input, if any, and report the changes
+    made by --sync-input. With --incremental, digest holds the hashes the job file was generated from, and
+    the status is the manifest state ('unchanged', 'edited', or 'new'/'changed' on dry runs) unless written.
+    Only this small tuple travels back from worker processes."""
+    stem = Path(path).stem
+    detected = None
+    try:
+        config = template.for_input(path, display_name=args.display_name)
+        if code is None:
+            code = detected = detect_code(path)
+        if model is not None:
+            from autotune import autotune
+            autotune(config, path, model, code)
+
+        init_orbs, init_check = None, None
+        if args.guess_orb_from is not None:
+            init_orbs = read_path_file(args.guess_orb_from, stem, '.orbitals')
+        if args.guess_check_from is not None:
+            init_check = read_path_file(args.guess_check_from, stem, '.checkpoint')
+
+        job = make_job(config, args, code=code or args.code, init_orbs=init_orbs, init_check=init_check)
+        if os.path.exists(job.jobfile) and not args.force and not args.incremental:
+            return job.jobfile, job.code, 'skipped', None, detected, None, None
+
+        report = None
+        if args.sync_input:
+            from inputsync import sync_job
+            report = sync_job(job, args.sync_input)
+
+        digest = None
+        if args.incremental:
+            from manifest import job_digest, manifest_for
+            digest = job_digest(job)
+            state = manifest_for(job.jobfile).state(job.jobfile, digest)
+            if state == 'unchanged' or args.dry_run or (state == 'edited' and not args.force):
+                return job.jobfile, job.code, state, None, detected, report, digest
+        job.write()
+    except (OSError, ValueError, KeyError, UnknownJonError) as e:
+        return None, None, 'failed', str(e), detected, None, None
+    return job.jobfile, job.code, 'written', None, detected, report, digest
+
+
+def _generate_star(task):
+    return generate(*task)
+
+
+def run_batch(inputs, template, args, jobs=1, cache=None, model=None):
+    """Generate job files for all inputs, spreading code detection, rendering and writing
+    over a pool of worker processes when jobs > 1. Codes known from the cache are passed
+    on and newly detected codes are added to it. Yields (path, result) in input order."""
+    codes = [cache.get(path) if cache is not None else None for path in inputs]
+    tasks = [(path, template, args, code, model) for path, code in zip(inputs, codes)]
+
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(_generate_star, tasks, chunksize=max(1, len(tasks) // (jobs * 8)))
+    else:
+        results = map(_generate_star, tasks)
+
+    try:
+        for path, result in zip(inputs, results):
+            if cache is not None:
+                cache.put(path, result[4])
+            yield path, result
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+class BatchSummary:
+    def __init__(self):
+        self.status = Counter()
+        self.codes = Counter()
+        self.failed = []
+
+    def add(self, path, code, status, error=None):
+        self.status[status] += 1
+        if status == 'failed':
+            self.failed.append((path, error))
+        else:
+            self.codes[code if code is not None else 'unknown'] += 1
+
+    def __str__(self):
+        total = sum(self.status.values())
+        lines = [f'Batch summary: {total} inputs, {self.status["written"]} written, '
+                 f'{self.status["skipped"]} skipped, {self.status["failed"]} failed' +
+                 ''.join(f', {self.status[s]} {s}' for s in ['unchanged', 'edited', 'new', 'changed'] if self.status[s])]
+        if self.codes:
+            lines.append('  ' + ', '.join(f'{code}: {n}' for code, n in sorted(self.codes.items())))
+        for path, error in self.failed:
+            lines.append(f'  failed: {path} ({error})')
+        return '\n'.join(lines)
@@ -6,19 +6,41 @@ def cli():
 
     # Top level parser arguments
     parser.add_argument('-v', '--verbose', action='store_true', help='Print extra information.')
-    parser.add_argument('-f', '--force', action='store_true', help='Do not ask when overwriting files.')
+    parser.add_argument('-f', '--force', action='store_true', help='Do not ask when overwriting files. In batch mode existing files are skipped without it.')
+    parser.add_argument('--incremental', action='store_true', help='Only write job files whose input, settings, environment or script changed since they were last written (recorded in .pyslurm-manifest.json in each job directory). With -X, only jobs changed since their last submission are submitted. Not for --array and --farm.')
+    parser.add_argument('--dry-run', action='store_true', help='List the job files that would be written, without writing or submitting anything (implies --incremental). Not for --array and --farm.')
 
     # Job related arguments
     job = parser.add_argument_group('Job related arguments')
-    job.add_argument('-i', '--input', type=str, help='Name of input file')
+    job.add_argument('-i', '--input', type=str, help='Name of input file, or a quoted glob pattern (e.g. \'*.inp\') for batch mode')
+    job.add_argument('--from-list', type=str, metavar='FILE', help='Batch mode: file listing one input file per line')
     job.add_argument('-o', '--output', type=str, help='Name of output file')
-    job.add_argument('-d', '--dest', default='.', type=str, help='Path to job directory')
+    job.add_argument('-d', '--dest', type=str, help='Path to job directory (default: directory of the input file)')
+    job.add_argument('-j', '--jobs', default=1, type=int, metavar='N', help='Batch mode: number of worker processes generating job files.')
     job.add_argument('-I', '--identifier', dest='id', type=str, help='Job name shown in the queue')
     job.add_argument('-s', '--suffix', type=str, help='Suffix appended to job name in queue')
     job.add_argument('-c', '--cluster', choices=['saga', 'fram', 'betzy'], type=str, help='Which cluster to submit to.')
+    job.add_argument('--no-code-cache', action='store_true', help='Batch mode: do not use the cache of detected codes.')
+    job.add_argument('--array', action='store_true', help='Batch mode: emit a single SLURM job array (named by --identifier) instead of one job file per input.')
+    job.add_argument('--array-limit', type=int, metavar='K', help='Maximum number of simultaneously running array tasks.')
+    job.add_argument('--farm', action='store_true', help='Batch mode: pack all ORCA/Gaussian inputs into one job (named by --identifier) running them as concurrent job steps.')
+    job.add_argument('--farm-slots', default=4, type=int, metavar='K', help='Number of calculations running at the same time in a farm. Each gets -nt x -nc CPUs.')
+    job.add_argument('--farm-step', default='exact', choices=['exact', 'exclusive'], help='srun option keeping farmed job steps apart (exclusive for Slurm < 21.08).')
     job.add_argument('-X', '--execute', action='store_true', help='Submit job to the queue')
     job.add_argument('--code', type=str, choices=['orca', 'gaussian', 'mrchem'], help='QC code input was made for')
 
+    # Submission related arguments
+    sub = parser.add_argument_group('Submission related arguments')
+    sub.add_argument('--submit', nargs='+', type=str, metavar='PATH', help='Submit existing job file(s) and exit.')
+    sub.add_argument('--sbatch', type=str, help='sbatch command to submit with (default: $PYSLURM_SBATCH or sbatch).')
+    sub.add_argument('--submit-jobs', default=4, type=int, metavar='N', help='Maximum number of concurrent sbatch calls.')
+    sub.add_argument('--rate', default=5.0, type=float, help='Maximum number of sbatch calls per second.')
+    sub.add_argument('--retries', default=5, type=int, help='Retries on transient controller errors (e.g. socket timeouts).')
+    sub.add_argument('--ledger', type=str, metavar='FILE', help='Record job file -> job ID in a JSON or CSV (.csv) ledger.')
+    sub.add_argument('--max-pending', type=int, metavar='K', help='Hold back submissions while K or more of your jobs are pending (polls squeue).')
+    sub.add_argument('--squeue', type=str, help='Command listing your pending jobs, one per line (default: $PYSLURM_SQUEUE or squeue --me -h -t PENDING -o %%i).')
+    sub.add_argument('--poll', default=30.0, type=float, metavar='S', help='Seconds between squeue polls with --max-pending.')
+
     # SLURM related arguments
     slurm = parser.add_argument_group('SLURM related arguments.')
     slurm.add_argument('-n', '--nodes', help='Number of nodes.')
@@ -41,20 +63,64 @@ def cli():
     slurm.add_argument('-E', '--exclusive', action='store_true', help='Request full nodes (discouraged).')
     slurm.add_argument('--display-name', type=str, help='Name used in the SLURM queue (not in file names)')
 
+    # Resource autotuning
+    auto = parser.add_argument_group('Resource autotuning arguments')
+    auto.add_argument('--auto-resources', action='store_true', help='Predict ntasks, walltime and memory from the input and job history (overrides -nt, -m and walltime).')
+    auto.add_argument('--history', type=str, metavar='FILE', help='sacct --parsable dump (JobID,JobName,State,Elapsed,NCPUS,MaxRSS) of previous jobs.')
+    auto.add_argument('--history-inputs', type=str, metavar='DIR', help='Directory with the inputs of the jobs in --history, named by job name (default: next to the dump).')
+
+    # Layout planning
+    lay = parser.add_argument_group('Layout planning arguments')
+    lay.add_argument('--layout', action='store_true', help='Plan nodes, tasks per node and threads per task from the node shape of the cluster, taking -m as the total memory.')
+    lay.add_argument('--cores', type=int, metavar='N', help='Total number of cores to plan the layout for (implies --layout, default: all cores requested).')
+
+    # Placement
+    place = parser.add_argument_group('Placement arguments')
+    place.add_argument('--placement', action='store_true', help='Submit to the cluster and partition (normal, bigmem, or the devel QOS) where the job is estimated to start first, from sinfo/squeue/sprio snapshots (overrides -c, -p and -D). -v explains the choice.')
+    place.add_argument('--snapshots', type=str, metavar='DIR', help='Directory with the queue snapshots <cluster>.sinfo, <cluster>.squeue and (optionally) <cluster>.sprio.')
+    place.add_argument('--snapshot-cmd', type=str, metavar='CMD', help='Command the snapshot queries are appended to, with {cluster} replaced, e.g. "ssh {cluster}.sigma2.no" (default: $PYSLURM_SNAPSHOT_CMD, or the queries of the cluster pyslurm runs on).')
+    place.add_argument('--placement-clusters', type=str, metavar='LIST', help='Comma separated clusters to consider (default: all with a snapshot).')
+    place.add_argument('--placement-partitions', type=str, metavar='LIST', help='Comma separated partitions to consider (default: normal,bigmem,devel).')
+
     # MRChem related arguments
     mrc = parser.add_argument_group('MRChem related arguments')
     mrc.add_argument('-V', '--version', type=str, help='Path to installed mrchem input parser (main executable)')
     mrc.add_argument('--json', action='store_true', help='Pass JSON option to MRChem launcher for JSON input file.')
-    mrc.add_argument('--guess-orb', type=str, metavar='PATH', help='Full path to directory holding initial guess orbitals. Will be copied to $SCRATCH/initial_guess.')
-    mrc.add_argument('--guess-check', type=str, metavar='PATH', help='Full path to directory holding checkpoint orbitals. Will be copied to $SCRATCH/checkpoint.')
+    mrc.add_argument('--guess-orb', type=str, metavar='PATH', help='Full path to directory holding initial guess orbitals, or orbstore:<id>. Will be copied to $SCRATCH/initial_guess.')
+    mrc.add_argument('--guess-check', type=str, metavar='PATH', help='Full path to directory holding checkpoint orbitals, or orbstore:<id>. Will be copied to $SCRATCH/checkpoint.')
+    mrc.add_argument('--guess-orb-from', type=str, metavar='DIR', help='Batch mode: read initial guess orbital path of each input from DIR/<stem>.orbitals.')
+    mrc.add_argument('--guess-check-from', type=str, metavar='DIR', help='Batch mode: read checkpoint path of each input from DIR/<stem>.checkpoint.')
     mrc.add_argument('--rm-orb', action='store_true', help='Do not copy optimized orbitals to storage.')
     mrc.add_argument('--rm-check', action='store_true', help='Do not copy checkpoint orbitals to storage.')
+    mrc.add_argument('--orb-store', nargs='?', const='', type=str, metavar='ROOT', help='Publish orbitals and checkpoints to a deduplicated store (default: /cluster/projects/<account>/$(whoami)/MWStore). The .orbitals and .checkpoint files then hold orbstore:<id> references.')
+    mrc.add_argument('--orb-compress', action='store_true', help='Store new orbital files gzip compressed.')
 
     # Misc arguments
     misc = parser.add_argument_group('Misc. arguments')
     misc.add_argument('-cpt', '--copy-to', nargs='+', type=str, metavar='PATH', help='Copy file(s) to $SCRATCH.')
+    misc.add_argument('--parallel-staging', action='store_true', help='Stage files in and out concurrently, skipping identical copies, and report staging times.')
+    misc.add_argument('--stage-workers', default=8, type=int, metavar='N', help='Concurrent copies per staged directory.')
+    misc.add_argument('--bcast', nargs='+', type=str, default=[], metavar='PATH', help='Copy file(s) to $SCRATCH, broadcast to node-local storage with sbcast on multi-node jobs (implies --parallel-staging).')
+    misc.add_argument('--bcast-guess', action='store_true', help='Broadcast MRChem guess orbitals to node-local storage on multi-node jobs (implies --parallel-staging).')
+    misc.add_argument('--sync-input', nargs='?', const='set', choices=['set', 'check'], help='Set %%pal/%%maxcore (ORCA) or %%nprocshared/%%mem (Gaussian) from the SLURM request, with memory headroom, in a copy of the input staged from <dest>/synced/ (default), or only report mismatches (check).')
+    misc.add_argument('--instrument', action='store_true', help='Record start and end time and peak memory (MaxRSS) of each phase of the job in <stem>.timing next to the log (see: pyslurm.py report).')
+    misc.add_argument('--requeue-on-timeout', action='store_true', help='Save outputs, orbitals and checkpoints when the time limit approaches, and submit a continuation job (<stem>_restart.job) restarting from them (ORCA: MOREAD, MRChem: checkpoint). Gaussian jobs are only saved.')
+    misc.add_argument('--requeue-lead', default=600, type=int, metavar='S', help='Seconds before the time limit the job is saved with --requeue-on-timeout (default: 600).')
+    misc.add_argument('--max-restarts', default=3, type=int, metavar='N', help='Maximum number of continuation jobs with --requeue-on-timeout (default: 3).')
+    misc.add_argument('--scratch', choices=['shared', 'local', 'auto'], help='Run on the shared $SCRATCH, on node-local $LOCALSCRATCH (requested with --gres=localscratch), or pick node-local scratch for a large expected disk footprint (auto). Default: the "scratch" of the environment of the cluster and code, or shared.')
+    misc.add_argument('--scratch-size', type=str, metavar='SIZE', help='Node-local scratch to request (e.g. 200GB). Default: the "scratch_size" of the environment, or the expected disk footprint.')
+    misc.add_argument('--disk', type=str, metavar='SIZE', help='Expected disk footprint of the calculation (e.g. 150GB), instead of the estimate from the input.')
+    misc.add_argument('--template', type=str, metavar='PATH', help='Job script template for the detected code (default: ~/.config/pyslurm/templates/<code>.sh, if it exists).')
     misc.add_argument('-cpb', '--copy-back', nargs='+', type=str, metavar='PATH', help='Copy file(s) back to $SLURM_SUBMIT_DIR.')
 
+    # Parameter sweeps
+    swp = parser.add_argument_group('Sweep arguments')
+    swp.add_argument('--sweep-nodes', type=str, metavar='SPEC', help='Generate one job per number of nodes (implies -L, sweeps imply --sync-input): a list (1,2,4) and/or ranges (1:8 or 1:8:2, or 1:8:x2 for 1,2,4,8).')
+    swp.add_argument('--sweep-ntasks', type=str, metavar='SPEC', help='Generate one job per number of tasks (per node with -L), as for --sweep-nodes.')
+    swp.add_argument('--sweep-cpus', type=str, metavar='SPEC', help='Generate one job per number of CPUs per task (implies --hybrid), as for --sweep-nodes.')
+    swp.add_argument('--sweep-memory', type=str, metavar='SPEC', help='Generate one job per memory request, with units (e.g. 8GB,16GB or 8GB:64GB:x2).')
+    swp.add_argument('--sweep-prune', action='store_true', help='Skip points that do not fit the nodes of the cluster, or whose threads straddle NUMA domains, instead of failing.')
+
     # Test related arguments
     test = parser.add_argument_group('Test related arguments')
     test.add_argument('--test-gaussian', action='store_true', help='Generate test inputs for Gaussian.')
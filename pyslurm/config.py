@@ -1,9 +1,11 @@
-import socket
+import copy
 from pathlib import Path
 
 
-def resolve_cluster():
-    """Determine which HPC cluster the code is currently running on."""
+def hostname_cluster():
+    """The HPC cluster the code is currently running on, or None if the hostname is not known."""
+    import socket
+
     h = socket.gethostname()
     if 'fram.sigma2.no' in h:
         return 'fram'
@@ -12,7 +14,41 @@ def resolve_cluster():
     elif 'betzy.sigma2.no' in h:
         return 'betzy'
     else:
-        return 'saga'
+        return None
+
+
+def resolve_cluster():
+    """Determine which HPC cluster the code is currently running on (default: saga)."""
+    cluster = hostname_cluster()
+    return cluster if cluster is not None else 'saga'
+
+
+def timelimit_from_args(args):
+    """Walltime in SLURM format from --stime, or from the convenience units --days, --hours, ..."""
+    if args.stime is not None:
+        return args.stime
+    return f'{args.days}-{args.hours}:{args.minutes}:{args.seconds}'
+
+
+def config_from_args(args, timelimit=None):
+    """The SLURM configuration requested on the command line."""
+    return Config(loc=args.loc,
+                  hybrid=args.hybrid,
+                  input=args.input,
+                  account=args.account,
+                  timelimit=timelimit if timelimit is not None else timelimit_from_args(args),
+                  memory=args.memory,
+                  memtype=args.memtype,
+                  nodes=args.nodes,
+                  ntasks=args.ntasks,
+                  cpus=args.cpus,
+                  mail=args.mail,
+                  partition=args.partition,
+                  cluster=args.cluster,
+                  dev=args.devel,
+                  exclusive=args.exclusive,
+                  display_name=args.display_name,
+                  signal=f'B:USR1@{args.requeue_lead}' if args.requeue_on_timeout else None)
 
 
 class SlurmSyntaxError(ValueError):
@@ -22,7 +58,8 @@ class SlurmSyntaxError(ValueError):
 class Config:
     def __init__(self, loc=False, dev=False, hybrid=False, account=None, timelimit=None, memory=None, nodes=None,
                  ntasks=None, cpus=None, ext_inp=None, ext_out=None, ext_log=None, ext_err=None, mail=None,
-                 input=None, partition=None, cluster=None, memtype=None, exclusive=False, display_name=None):
+                 input=None, partition=None, cluster=None, memtype=None, exclusive=False, display_name=None, array=None,
+                 layout=None, signal=None, gres=None):
 
         self.account = account if account is not None else ''
         self.timelimit = timelimit if timelimit is not None else '30:00'
@@ -44,6 +81,10 @@ class Config:
         self.qos = 'devel' if self.dev else None
         self.cluster = cluster if cluster is not None else resolve_cluster()
         self.exclusive = exclusive
+        self.array = array
+        self.layout = layout
+        self.signal = signal
+        self.gres = gres
         
         self.input_stem = Path(self.input).stem
         self.display_name = self.input_stem if display_name is None else display_name
@@ -54,6 +95,18 @@ class Config:
 
         self.build_config()
 
+    def for_input(self, input, display_name=None):
+        """Return a copy of this configuration stamped out for another input file."""
+        c = copy.copy(self)
+        c.input = input
+        c.input_stem = Path(input).stem
+        c.display_name = c.input_stem if display_name is None else display_name
+        if c.ext_inp in c.input:
+            c.input = c.input[:-4]
+
+        c.build_config()
+        return c
+
     def add_section(self, key, val):
         if val is None:
             self.config.append(f'#SBATCH --{key}')
@@ -65,10 +118,22 @@ class Config:
         self.add_section('account', self.account)
         self.add_section('mail-type', self.mail)
         self.add_section('job-name', self.display_name)
-        self.add_section('output', self.input_stem + self.ext_log)
-        self.add_section('error', self.input_stem + self.ext_err)
+
+        # Array elements are told apart by their index until the body resolves the input stem
+        if self.array is not None:
+            self.add_section('output', self.input_stem + '_%a' + self.ext_log)
+            self.add_section('error', self.input_stem + '_%a' + self.ext_err)
+            self.add_section('array', self.array)
+        else:
+            self.add_section('output', self.input_stem + self.ext_log)
+            self.add_section('error', self.input_stem + self.ext_err)
         self.add_section('time', self.timelimit)
 
+        # Warning ahead of the time limit, continuation jobs append to the same log
+        if self.signal is not None:
+            self.add_section('signal', self.signal)
+            self.add_section('open-mode', 'append')
+
         if self.partition != 'Normal':
             self.add_section('partition', self.partition)
 
@@ -77,7 +142,7 @@ class Config:
             self.add_section('qos', self.qos)
 
         # Memory specification
-        if self.cluster.lower() != 'fram':
+        if self.cluster.lower() != 'fram' or self.layout is not None:
             if self.memtype == 'tot':
                 self.add_section('mem', self.memory)
             elif self.memtype == 'cpu':
@@ -86,8 +151,16 @@ class Config:
         if self.exclusive:
             self.add_section('exclusive', None)
 
+        # Node-local scratch
+        if self.gres is not None:
+            self.add_section('gres', self.gres)
+
         # Determine parallel scheme
-        if self.loc:
+        if self.layout is not None:
+            self.add_section('nodes', self.layout.nodes)
+            self.add_section('ntasks-per-node', self.layout.tasks_per_node)
+            self.add_section('cpus-per-task', self.layout.threads)
+        elif self.loc:
             self.add_section('nodes', self.nodes)
             self.add_section('ntasks-per-node', self.ntasks)
         else:
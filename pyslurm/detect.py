@@ -0,0 +1,146 @@
+import json
+import os
+import re
+
+from jobs import write_atomic
+
+# Code detection only looks at the head of the input, never at geometries or basis sets further down
+MAX_LINES = 500
+MAX_BYTES = 64 * 1024
+MAX_LINE_LENGTH = 4096
+
+# A Gaussian route line (#, #p, #n or #t), as opposed to a comment starting with #
+ROUTE = re.compile(r'#[pnt]?(\s|$)', re.IGNORECASE)
+
+
+class UnknownJonError(NameError):
+    pass
+
+
+class AmbiguousCodeError(UnknownJonError):
+    pass
+
+
+def scan_header(f):
+    """Stream the header of an input file and collect the codes it looks like it was made for.
+    Reading stops at world_prec (MRChem) or at the ORCA/MRChem coordinate block, otherwise at the
+    MAX_LINES/MAX_BYTES bound. MRChem and ORCA coordinates take precedence over the keyword and route
+    heuristics, as # and ! also start comments."""
+    hits = set()
+    keywords = False
+    route = None
+    nbytes = 0
+    with open(f, errors='replace') as file:
+        for _ in range(MAX_LINES):
+            line = file.readline(MAX_LINE_LENGTH)
+            nbytes += len(line)
+            if not line or nbytes > MAX_BYTES:
+                break
+
+            s = line.strip()
+            low = s.lower()
+            compact = low.replace(' ', '')
+
+            if 'world_prec' in low:
+                hits.add('mrchem')
+                break
+            if compact.startswith('$coords'):
+                break
+
+            # ORCA: simple input lines and coordinate blocks. ! lines before a Gaussian route are comments.
+            if compact.startswith('*xyz') or compact.startswith('%coords'):
+                hits.add('orca')
+                break
+            if s.startswith('!'):
+                keywords = True
+                continue
+
+            # Gaussian: the route section is the first line after the Link0 (%key=value) commands.
+            # Scanning goes on past it, as a # comment looks like a route.
+            if route is None and s and not (s.startswith('%') and '=' in s):
+                route = bool(ROUTE.match(s))
+
+    if hits:
+        return hits
+    if route:
+        hits.add('gaussian')
+    elif keywords:
+        hits.add('orca')
+    return hits
+
+
+def resolve_code(f):
+    """Reads the header of input file and determines whether it is meant for Gaussian, ORCA, or MRChem.
+    Returns tuple of booleans. Raises AmbiguousCodeError if it looks like input to more than one code."""
+    try:
+        hits = scan_header(f)
+    except FileNotFoundError:
+        return False, False, False
+
+    if len(hits) > 1:
+        raise AmbiguousCodeError(f'Multiple codes detected in {f}: {", ".join(sorted(hits))}')
+    return 'gaussian' in hits, 'orca' in hits, 'mrchem' in hits
+
+
+def detect_code(f):
+    """Name of the code the input file was made for, or None if it could not be determined."""
+    for code, hit in zip(['gaussian', 'orca', 'mrchem'], resolve_code(f)):
+        if hit:
+            return code
+    return None
+
+
+def default_cache_path():
+    cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache, 'pyslurm', 'codes.json')
+
+
+class CodeCache:
+    """Persistent map from input file to detected code, invalidated by the file's mtime and size."""
+    def __init__(self, path=None):
+        self.path = path if path is not None else default_cache_path()
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(f):
+        st = os.stat(f)
+        return os.path.abspath(f), [st.st_mtime_ns, st.st_size]
+
+    def get(self, f):
+        try:
+            path, stamp = self.key(f)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+        return None
+
+    def put(self, f, code):
+        if code is None:
+            return
+        try:
+            path, stamp = self.key(f)
+        except OSError:
+            return
+        self.entries[path] = stamp + [code]
+        self.dirty = True
+
+    def detect(self, f):
+        """Detect code of f, using and updating the cache."""
+        code = self.get(f)
+        if code is None:
+            code = detect_code(f)
+            self.put(f, code)
+        return code
+
+    def save(self):
+        if self.dirty:
+            write_atomic(self.path, json.dumps(self.entries))
+            self.dirty = False
@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = os.environ.get('XDG_CONFIG_HOME', os.path.join(os.path.expanduser('~'), '.config'))
+
+# Later files override earlier ones per cluster, code and key
+BUNDLED = os.path.join(ROOT, 'default_environments.json')
+SITE = os.environ.get('PYSLURM_SITE_ENVIRONMENTS', '/etc/pyslurm/environments.json')
+USER = os.environ.get('PYSLURM_USER_ENVIRONMENTS', os.path.join(CONFIG, 'pyslurm', 'environments.json'))
+
+# Keys every environment entry must define, per code
+REQUIRED = {'orca': ['modules', 'exe', 'mpi'],
+            'gaussian': ['modules', 'exe'],
+            'mrchem': ['modules', 'exe']}
+
+# Scratch policies an environment entry may set (see scratch.py)
+SCRATCH = ['shared', 'local', 'auto']
+
+_environments = None
+
+
+class EnvironmentSchemaError(ValueError):
+    pass
+
+
+def merge(base, override):
+    """Merge override into base, one level of cluster and code at a time."""
+    merged = {cluster: {code: dict(entry) for code, entry in codes.items()} for cluster, codes in base.items()}
+    for cluster, codes in override.items():
+        for code, entry in codes.items():
+            merged.setdefault(cluster, {}).setdefault(code, {}).update(entry)
+    return merged
+
+
+def validate(environments, sources):
+    """Check the layout cluster -> code -> {modules: [str], exe: str, mpi: str, scratch: str, scratch_size: str}."""
+    def fail(msg):
+        raise EnvironmentSchemaError(f'Invalid environment ({", ".join(sources)}): {msg}')
+
+    if not isinstance(environments, dict):
+        fail('expected a mapping of clusters')
+    for cluster, codes in environments.items():
+        if not isinstance(codes, dict):
+            fail(f'{cluster}: expected a mapping of codes')
+        for code, entry in codes.items():
+            if not isinstance(entry, dict):
+                fail(f'{cluster}/{code}: expected a mapping')
+            for key in REQUIRED.get(code, ['modules', 'exe']):
+                if key not in entry:
+                    fail(f'{cluster}/{code}: missing "{key}"')
+            modules = entry['modules']
+            if not isinstance(modules, list) or not all(isinstance(m, str) for m in modules):
+                fail(f'{cluster}/{code}: "modules" must be a list of strings')
+            for key in ['exe', 'mpi', 'scratch_size']:
+                if key in entry and not isinstance(entry[key], str):
+                    fail(f'{cluster}/{code}: "{key}" must be a string')
+            if entry.get('scratch', 'shared') not in SCRATCH:
+                fail(f'{cluster}/{code}: "scratch" must be one of {", ".join(SCRATCH)}')
+
+
+def load_environments(paths=None):
+    """Load the bundled environments and layer the site and user files on top, if they exist."""
+    try:
+        with open(BUNDLED) as f:
+            environments = json.load(f)
+    except FileNotFoundError:
+        sys.exit('Error reading default environments.')
+
+    sources = [BUNDLED]
+    for path in paths if paths is not None else [SITE, USER]:
+        try:
+            with open(path) as f:
+                override = json.load(f)
+        except FileNotFoundError:
+            continue
+        except ValueError as e:
+            raise EnvironmentSchemaError(f'Invalid environment ({path}): {e}')
+
+        if not isinstance(override, dict) or not all(isinstance(c, dict) and all(isinstance(e, dict) for e in c.values())
+                                                     for c in override.values()):
+            raise EnvironmentSchemaError(f'Invalid environment ({path}): expected a mapping of clusters to codes')
+        environments = merge(environments, override)
+        sources.append(path)
+
+    validate(environments, sources)
+    return environments
+
+
+def get_environments():
+    """The environment registry, loaded and validated once per process. Prologues rendered from an
+    earlier registry are dropped when it is reloaded."""
+    global _environments
+    if _environments is None:
+        from jobs import PROLOGUES
+        PROLOGUES.clear()
+        _environments = load_environments()
+    return _environments
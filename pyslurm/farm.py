@@ -0,0 +1,120 @@
+import os
+import re
+from pathlib import Path
+
+from batch import make_job
+from detect import detect_code
+from inputsync import sync_job
+from jobs import write_atomic
+
+
+class FarmError(ValueError):
+    pass
+
+
+class FarmJob:
+    """Many small calculations packed into one allocation of a number of slots.
+
+    Every calculation gets its own task script (the usual job body, working in its own
+    $SCRATCH subdirectory), run as a job step of one task with the CPUs of a slot. The
+    farm script starts the next calculation as soon as a slot frees up, and keeps a
+    status file per calculation."""
+    def __init__(self, config, tasks, memory, dest=None, slots=4, step='exact', reports=None):
+        self.config = config
+        self.reports = reports if reports is not None else []
+        self.memory = memory
+        self.tasks = tasks
+        self.dest = Path(dest) if dest is not None else Path('.')
+        self.slots = slots
+        self.step = step
+        self.ext = '.job'
+        self.code = ', '.join(sorted({t.code for t in tasks}))
+        self.name = config.input_stem
+        self.jobfile = str(self.dest / (self.name + self.ext))
+        self.manifest = str(self.dest / (self.name + '.manifest'))
+        self.taskdir = self.name + '.tasks'
+        self.statusdir = self.name + '.status'
+        self.job = self.build_job()
+
+    def __str__(self):
+        return '\n'.join(self.job)
+
+    def build_job(self):
+        c = self.config
+        job = ['']
+        job.append(f'SLOTS={self.slots}')
+        job.append(f'mkdir -p {self.statusdir}')
+        job.append('')
+        job.append('run_task() {')
+        job.append(f'    echo "RUNNING $(date +%s)" > {self.statusdir}/$1')
+        mem = 'mem' if c.memtype == 'tot' else 'mem-per-cpu'
+        job.append(f'    srun --{self.step} --nodes=1 --ntasks=1 --cpus-per-task={c.cpus} --{mem}={self.memory} '
+                   f'bash {self.taskdir}/$1.sh > $1{c.ext_log} 2> $1{c.ext_err}')
+        job.append('    rc=$?')
+        job.append('    if [ $rc -eq 0 ]; then')
+        job.append(f'        echo "DONE $(date +%s)" > {self.statusdir}/$1')
+        job.append('    else')
+        job.append(f'        echo "FAILED $(date +%s) $rc" > {self.statusdir}/$1')
+        job.append('    fi')
+        job.append('}')
+        job.append('')
+        job.append('while read -u 3 STEM; do')
+        job.append('    while [ $(jobs -rp | wc -l) -ge $SLOTS ]; do wait -n; done')
+        job.append('    run_task $STEM &')
+        job.append(f'done 3< {Path(self.manifest).name}')
+        job.append('wait')
+        job.append('')
+        job.append('exit 0')
+        return job
+
+    def write(self):
+        for t in self.tasks:
+            if t.staged is not None:
+                write_atomic(*t.staged)
+            write_atomic(str(self.dest / self.taskdir / (t.stem + '.sh')), '#!/bin/bash\n' + str(t))
+        write_atomic(self.manifest, ''.join(t.stem + '\n' for t in self.tasks))
+        write_atomic(self.jobfile, str(self.config) + '\n' + str(self))
+
+
+def make_farm(inputs, template, args, name='farm', slots=4, step='exact', cache=None):
+    """Pack all inputs into one farm job. Each calculation gets the resources of one slot:
+    the tasks times CPUs per task given on the command line."""
+    dest = args.dest if args.dest is not None else '.'
+    detect = cache.detect if cache is not None else detect_code
+
+    stems = [Path(i).stem for i in inputs]
+    if len(set(stems)) != len(stems):
+        raise FarmError('Farmed inputs need unique file names')
+
+    tasks, reports = [], []
+    for path in inputs:
+        code = detect(path) or args.code
+        if code is None:
+            raise FarmError(f'{path}: code could not be determined, use --code')
+        if code == 'mrchem':
+            raise FarmError(f'{path}: MRChem launches its own job steps and cannot be farmed')
+
+        task = make_job(template.for_input(path), args, code=code)
+        task.dest = Path(dest)
+        task.set_input(os.path.splitext(path)[0])
+        task.scratch = f'$SCRATCH/{task.stem}'
+        task.job = task.build_job()
+        if args.sync_input:
+            report = sync_job(task, args.sync_input)
+            if report is not None:
+                reports.append((path, report))
+        tasks.append(task)
+
+    # One task per slot, with all CPUs and memory of a calculation
+    config = template.for_input(name, display_name=args.display_name)
+    cores = int(config.ntasks) * (int(config.cpus) if config.hybrid else 1)
+    memory = config.memory
+    if config.memtype == 'tot':
+        value, unit = re.match(r'([0-9.]+)\s*(\D+)', memory).groups()
+        config.memory = f'{float(value) * slots:g}{unit}'
+    config.ntasks = str(slots)
+    config.cpus = str(cores)
+    config.hybrid = True
+    config.loc = False
+    config.build_config()
+    return FarmJob(config, tasks, memory, dest=dest, slots=slots, step=step, reports=reports)
@@ -0,0 +1,199 @@
+import math
+import re
+from pathlib import Path
+
+from layout import memory_gb
+
+# Share of the requested memory given to the program, the rest is left for the OS, MPI and buffers.
+# ORCA regularly uses more than %maxcore, Gaussian a little more than %mem.
+ORCA_HEADROOM = 0.75
+GAUSSIAN_HEADROOM = 0.85
+
+# Directory in the job directory the adjusted inputs are written to (with unchanged file names)
+SYNCED = 'synced'
+
+PAL_KEYWORD = re.compile(r'\s*\bPAL(\d+)\b', re.IGNORECASE)
+NPROCS = re.compile(r'(\bnprocs\s+)(\d+)', re.IGNORECASE)
+GAUSSIAN_MEMORY = re.compile(r'([0-9.]+)\s*([KMGT]?)([BW]?)$', re.IGNORECASE)
+
+
+def tasks_per_node(config):
+    if config.layout is not None:
+        return config.layout.tasks_per_node
+    return int(config.ntasks)
+
+
+def total_tasks(config):
+    if config.layout is not None:
+        return config.layout.ntasks
+    return int(config.ntasks) * (int(config.nodes) if config.loc else 1)
+
+
+def threads(config):
+    return int(config.cpus) if config.hybrid else 1
+
+
+def memory_per_task(config):
+    """MB of memory per MPI task (on its node)."""
+    memory = memory_gb(config.memory) * 1024
+    if config.memtype == 'cpu':
+        return memory * threads(config)
+    return memory / tasks_per_node(config)
+
+
+def gaussian_mb(value):
+    """MB from a Gaussian %mem value (plain numbers are 8 byte words)."""
+    m = GAUSSIAN_MEMORY.match(value.strip())
+    if not m:
+        return None
+    scale = {'': 1 / 1024**2, 'K': 1 / 1024, 'M': 1.0, 'G': 1024.0, 'T': 1024.0**2}[m.group(2).upper()]
+    return float(m.group(1)) * scale * (8 if m.group(3).upper() != 'B' else 1)
+
+
+def sync_orca(lines, nprocs, maxcore):
+    """Set %pal nprocs and %maxcore, replacing PALn keywords. Missing directives are added after the
+    last simple input (!) line. Returns the new lines and the changes as (directive, old, new)."""
+    out, changes = [], []
+    pal, has_pal, has_maxcore = False, False, False
+    for line in lines:
+        s = line.strip().lower()
+        if s.startswith('!') and PAL_KEYWORD.search(line):
+            old = int(PAL_KEYWORD.search(line).group(1))
+            if old == nprocs:
+                has_pal = True
+            else:
+                changes.append(('nprocs', old, nprocs))
+                line = PAL_KEYWORD.sub('', line)
+        elif s.startswith('%maxcore'):
+            has_maxcore = True
+            old = line.split()[1] if len(line.split()) > 1 else None
+            if old != str(maxcore):
+                changes.append(('maxcore', int(old) if old and old.isdigit() else old, maxcore))
+                line = f'%maxcore {maxcore}'
+        elif s.startswith('%pal'):
+            pal = True
+
+        if pal:
+            m = NPROCS.search(line)
+            if m:
+                has_pal = True
+                if int(m.group(2)) != nprocs:
+                    changes.append(('nprocs', int(m.group(2)), nprocs))
+                    line = NPROCS.sub(rf'\g<1>{nprocs}', line)
+            if re.search(r'\bend\b', s):
+                pal = False
+        out.append(line)
+
+    missing = []
+    if not has_pal:
+        missing.append(f'%pal nprocs {nprocs} end')
+        if not any(c[0] == 'nprocs' for c in changes):
+            changes.append(('nprocs', None, nprocs))
+    if not has_maxcore:
+        missing.append(f'%maxcore {maxcore}')
+        changes.append(('maxcore', None, maxcore))
+    keywords = [i for i, line in enumerate(out) if line.strip().startswith('!')]
+    at = keywords[-1] + 1 if keywords else 0
+    return out[:at] + missing + out[at:], changes
+
+
+def sync_gaussian(lines, nprocs, mem):
+    """Set %nprocshared and %mem (MB) in the Link 0 section of every job step (--Link1--).
+    Returns the new lines and the changes as (directive, old, new)."""
+    out, changes = [], []
+    link0, has = True, {}
+
+    def finish():
+        for key, value in [('nprocshared', nprocs), ('mem', f'{mem}MB')]:
+            if key not in has:
+                out.append(f'%{key}={value}')
+                changes.append((key, None, value))
+
+    for line in lines:
+        s = line.strip().lower()
+        if link0 and s.startswith('%') and '=' in s:
+            key, _, old = line.strip()[1:].partition('=')
+            key = key.strip().lower()
+            if key in ['nprocshared', 'nproc']:
+                has['nprocshared'] = True
+                if old.strip() != str(nprocs):
+                    changes.append(('nprocshared', old.strip(), nprocs))
+                    line = f'%nprocshared={nprocs}'
+            elif key == 'mem':
+                has['mem'] = True
+                if gaussian_mb(old) != mem:
+                    changes.append(('mem', old.strip(), f'{mem}MB'))
+                    line = f'%mem={mem}MB'
+        elif link0 and s:
+            finish()
+            link0 = False
+        elif s == '--link1--':
+            link0, has = True, {}
+        out.append(line)
+    return out, changes
+
+
+def violations(changes):
+    """Changes that matter when only checking: a different number of processes, or more memory
+    than the request leaves room for."""
+    bad = []
+    for key, old, new in changes:
+        if key in ['nprocs', 'nprocshared'] and str(old) != str(new):
+            bad.append((key, old, new))
+        elif key == 'maxcore' and old is not None and (not str(old).isdigit() or int(old) > new):
+            bad.append((key, old, new))
+        elif key == 'mem' and old is not None and (gaussian_mb(old) or math.inf) > gaussian_mb(new):
+            bad.append((key, old, new))
+    return bad
+
+
+def sync_input(path, code, config, text=None):
+    """Adjust the parallel and memory directives of an ORCA or Gaussian input to the resources of config.
+    The input is read from path unless its text is given. Returns the adjusted text and the changes,
+    or (None, []) for other codes."""
+    if code not in ['orca', 'gaussian']:
+        return None, []
+    if text is None:
+        with open(path) as f:
+            text = f.read()
+    lines = text.split('\n')
+
+    if code == 'orca':
+        maxcore = int(memory_per_task(config) * ORCA_HEADROOM)
+        lines, changes = sync_orca(lines, total_tasks(config), maxcore)
+    else:
+        nprocs = tasks_per_node(config) * threads(config)
+        mem = int(memory_per_task(config) * tasks_per_node(config) * GAUSSIAN_HEADROOM)
+        lines, changes = sync_gaussian(lines, nprocs, mem)
+    return '\n'.join(lines), changes
+
+
+def format_changes(changes):
+    # Multi-step Gaussian inputs repeat the same changes for every step
+    unique = list(dict.fromkeys(changes))
+    return ', '.join(f'{key} {old if old is not None else "(unset)"} -> {new}' for key, old, new in unique)
+
+
+def sync_file(path, code, config, dest, mode='set', text=None):
+    """Sync the input at path (or its text, if given) to config. Returns the adjusted copy to stage as (path, text), in
+    <dest>/synced/ with the same file name (set mode only), and a report of the changes (set) or
+    the mismatches (check). Both are None if there is nothing to report."""
+    text, changes = sync_input(path, code, config, text)
+    if mode == 'check':
+        changes = violations(changes)
+    if not changes:
+        return None, None
+
+    staged = (str(Path(dest) / SYNCED / Path(path).name), text) if mode == 'set' else None
+    return staged, format_changes(changes)
+
+
+def sync_job(job, mode='set'):
+    """Keep the input of job in sync with its SLURM request, starting from the input already staged
+    for the job, if any. Returns the report of sync_file."""
+    text = job.staged[1] if job.staged is not None else None
+    staged, report = sync_file(job.config.input + job.config.ext_inp, job.code, job.config, job.dest, mode, text)
+    if staged is not None:
+        job.stage_input(*staged)
+        job.job = job.build_job()
+    return report
@@ -0,0 +1,29 @@
+# Shell function emitted into instrumented job scripts. Every call appends one JSON line with a
+# timestamp and the peak memory of the job steps so far (sstat, empty if unavailable) to
+# <stem>.timing in the submit directory, next to the .log file.
+FUNCTIONS = r'''PYSLURM_TIMING=${SLURM_SUBMIT_DIR:-.}/@STEM@.timing
+pyslurm_mark() {
+    local rss=$(timeout 10 sstat -a -n -P -j ${SLURM_JOB_ID} -o MaxRSS 2>/dev/null | sort -h | tail -n 1)
+    printf '{"job": "%s", "stem": "%s", "code": "%s", "cluster": "%s", "phase": "%s", "event": "%s", "time": %s, "maxrss": "%s"}\n' \
+        "${SLURM_JOB_ID}" "@STEM@" "@CODE@" "@CLUSTER@" "$1" "$2" "$(date +%s.%N)" "$rss" >> $PYSLURM_TIMING
+}'''
+
+PHASES = ['prologue', 'stage_in', 'run', 'stage_out']
+
+
+def functions(stem, code, cluster):
+    return FUNCTIONS.replace('@STEM@', stem).replace('@CODE@', str(code)).replace('@CLUSTER@', cluster)
+
+
+def wrap(phase, text):
+    """Surround the script section of a phase with start and end markers."""
+    return f'pyslurm_mark {phase} start\n{text}\npyslurm_mark {phase} end'
+
+
+def add_markers(fields, stem, code, cluster):
+    """Add markers around every phase of the rendered sections, with the marker function
+    defined ahead of the prologue."""
+    for phase in PHASES:
+        fields[phase] = wrap(phase, fields[phase])
+    fields['prologue'] = functions(stem, code, cluster) + '\n\n' + fields['prologue']
+    return fields
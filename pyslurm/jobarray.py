@@ -0,0 +1,89 @@
+import os
+from pathlib import Path
+
+from batch import make_job
+from detect import detect_code
+from inputsync import sync_file
+from jobs import write_atomic
+
+
+class MixedArrayError(ValueError):
+    pass
+
+
+class ArrayJob:
+    """A single SLURM job array running the same job for every input listed in an index manifest.
+
+    The element job is rendered once with shell variables in place of the file names,
+    and line i of the manifest holds the input (relative to the job directory, without
+    extension) of array task i."""
+    def __init__(self, element, inputs, dest=None, staged=None, reports=None):
+        self.element = element
+        self.staged = staged if staged is not None else []
+        self.reports = reports if reports is not None else []
+        self.config = element.config
+        self.dest = Path(dest) if dest is not None else Path('.')
+        self.inputs = [os.path.relpath(i, self.dest) for i in inputs]
+        self.code = element.code
+        self.jobfile = str(self.dest / (self.config.input_stem + element.ext))
+        self.manifest = str(self.dest / (self.config.input_stem + '.manifest'))
+        self.job = self.build_job()
+
+    def __str__(self):
+        return '\n'.join(self.job)
+
+    def build_job(self):
+        c = self.config
+        job = ['']
+        job.append(f'STEM_PATH=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {Path(self.manifest).name})')
+        job.append('STEM=$(basename ${STEM_PATH})')
+        job.append(f'INPUT=${{STEM_PATH}}{c.ext_inp}')
+        job.append(f'exec > ${{STEM}}{c.ext_log} 2> ${{STEM}}{c.ext_err}')
+        return job + self.element.job
+
+    def write(self):
+        for path, text in self.staged:
+            write_atomic(path, text)
+        write_atomic(self.manifest, ''.join(i[:-len(self.config.ext_inp)] + '\n' for i in self.inputs))
+        write_atomic(self.jobfile, str(self.config) + '\n' + str(self))
+
+
+def make_array(inputs, template, args, name='array', limit=None, cache=None):
+    """Build one job array for a homogeneous set of inputs. All inputs must be made for the same code."""
+    detect = cache.detect if cache is not None else detect_code
+    codes = {detect(i) or args.code for i in inputs}
+    if None in codes:
+        raise MixedArrayError('code could not be determined, use --code')
+    if len(codes) > 1:
+        raise MixedArrayError(f'Job arrays need inputs for a single code, found: {", ".join(sorted(map(str, codes)))}')
+
+    config = template.for_input(name, display_name=args.display_name)
+    config.array = f'0-{len(inputs) - 1}' + (f'%{limit}' if limit is not None else '')
+    config.build_config()
+
+    # Per-input orbital paths are read at runtime, after the script has moved to $SCRATCH
+    dest = args.dest if args.dest is not None else '.'
+    init_orbs, init_check = None, None
+    if args.guess_orb_from is not None:
+        init_orbs = f'$(cat ${{SLURM_SUBMIT_DIR}}/{os.path.relpath(args.guess_orb_from, dest)}/${{STEM}}.orbitals)'
+    if args.guess_check_from is not None:
+        init_check = f'$(cat ${{SLURM_SUBMIT_DIR}}/{os.path.relpath(args.guess_check_from, dest)}/${{STEM}}.checkpoint)'
+
+    element = make_job(config, args, code=codes.pop(), init_orbs=init_orbs, init_check=init_check)
+    element.set_input('${STEM}')
+    element.inputpath = '${INPUT}'
+    element.job = element.build_job()
+
+    # Adjusted inputs are listed in the manifest in place of the originals
+    staged, reports = [], []
+    if args.sync_input:
+        synced = []
+        for path in inputs:
+            copy, report = sync_file(path, element.code, config, dest, args.sync_input)
+            if copy is not None:
+                staged.append(copy)
+            if report is not None:
+                reports.append((path, report))
+            synced.append(copy[0] if copy is not None else path)
+        inputs = synced
+    return ArrayJob(element, inputs, dest=dest, staged=staged, reports=reports)
@@ -1,52 +1,65 @@
-import json
-import sys
-import json
+import copy
 import os
+import tempfile
 from pathlib import Path
 
-ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from environment import get_environments
+from inputsync import total_tasks
+from instrument import add_markers
+from templates import load_template
 
+# Prologues (module and environment setup) rendered once per cluster and code, cleared when the
+# environment registry is reloaded (see environment.get_environments)
+PROLOGUES = {}
 
-def resolve_code(f):
-    """Reads input file and determines whether it is meant for Gaussian, ORCA, or MRChem.
-    Returns tuple of booleans."""
-    try:
-        with open(f) as file:
-            s = file.read()
-    except FileNotFoundError:
-        return False, False, False
-
-    is_gaussian, is_orca, is_mrchem = False, False, False
-
-    if 'world_prec' in s:
-        is_mrchem = True
-    elif '*xyz' in s or '* xyz' in s:
-        is_orca = True
-    elif '#p' in s or '# p' in s:
-        is_gaussian = True
-    else:
-        return False, False, False
+# Temporary files are created with mode 0600, restore the permissions a plain open() would give
+UMASK = os.umask(0)
+os.umask(UMASK)
 
-    test = not sum([is_gaussian, is_orca, is_mrchem]) > 1
-    assert test, UnknownJonError(f'Multiple codes detected. Sum = {test}')
-    return is_gaussian, is_orca, is_mrchem
+# Jobs on node-local scratch copy their results back as soon as they are saved
+LOCAL_SAVEFILE = 'savefile() { cp -r "$@" ${SLURM_SUBMIT_DIR}/; }'
 
+# Run by the generated MRChem scripts to publish to and materialise from an orbital store
+ORBSTORE = str(Path(__file__).resolve().with_name('orbstore.py'))
 
-class UnknownJonError(NameError):
-    pass
 
+def write_atomic(path, text):
+    """Write text to a temporary file next to path and rename it into place, so that an
+    interrupted run never leaves a truncated file behind."""
+    parent = Path(path).parent
+    parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=parent, prefix=f'.{Path(path).name}', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp, 0o666 & ~UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
 
 class Job:
-    def __init__(self, config=None, need_files=None, save_files=None):
+    # Whether a continuation job can restart from the state saved on timeout (--requeue-on-timeout)
+    restartable = False
+
+    def __init__(self, config=None, need_files=None, save_files=None, dest=None, template=None, staging=None,
+                 instrument=False, requeue=None, local_scratch=False):
         self.config = config
         self.ext = '.job'
-        self.inputfile = self.config.input + self.config.ext_inp
-        self.outputfile = self.config.input + self.config.ext_out
-        self.jobfile = self.config.input + self.ext
+        self.dest = Path(dest) if dest is not None else Path(self.config.input).parent
+        self.set_input(self.config.input)
         self.cluster = self.config.cluster
         self.need_files = need_files if need_files is not None else []
         self.save_files = save_files if save_files is not None else []
+        self.template = template
+        self.local_scratch = local_scratch
+        self.scratch = '$LOCALSCRATCH' if local_scratch else '$SCRATCH'
+        self.staging = staging
+        self.staged = None
+        self.instrument = instrument
+        self.requeue = requeue
+        self.restart = False
         self.environment = self.load_default_environment()
         self.code = None
         self.job = []
@@ -55,94 +68,246 @@ class Job:
         return '\n'.join(self.job)
 
     def build_job(self):
-        pass
+        """Render the job script body from the template of the code. Only the prologue is shared
+        between jobs, the other sections and fields are filled in per input. Instrumented jobs
+        record the start and end of every section in <stem>.timing. With requeue (the maximum number of
+        restarts), the calculation is saved and continued when the time limit approaches."""
+        c = self.config
+        fields = {'prologue': self.prologue(),
+                  'stage_in': '\n'.join(self.build_stage_in()),
+                  'run': '\n'.join(self.build_run()),
+                  'stage_out': '\n'.join(self.build_stage_out()),
+                  'input': self.inputfile,
+                  'output': self.outputfile,
+                  'stem': self.stem,
+                  'cluster': self.cluster,
+                  'account': c.account,
+                  'nodes': c.nodes,
+                  'ntasks': c.ntasks,
+                  'cpus': c.cpus,
+                  'memory': c.memory,
+                  'timelimit': c.timelimit}
+        if self.requeue is not None:
+            from requeue import add_trap
+            add_trap(fields, self)
+        if self.instrument:
+            add_markers(fields, self.stem, self.code, self.cluster)
+        return load_template(self.code, self.template).render(fields).split('\n')
+
+    def prologue(self):
+        key = (self.cluster, self.code)
+        if key not in PROLOGUES:
+            PROLOGUES[key] = '\n'.join(self.build_prologue())
+        return PROLOGUES[key]
+
+    def build_prologue(self):
+        job = ['module purge']
+        for mod in self.environment[self.cluster][self.code]['modules']:
+            job.append(f'module load {mod}')
+        return job
+
+    def build_stage_in(self):
+        # savefile only copies back from $SCRATCH, node-local scratch is reclaimed when the job ends
+        job = [LOCAL_SAVEFILE, ''] if self.local_scratch else []
+        if self.staging is not None:
+            return job + self.staging.stage_in(self.inputpath, self.need_files, self.scratch, self.guesses())
+
+        if self.scratch != '$SCRATCH':
+            job.append(f'mkdir -p {self.scratch}')
+        job.append(f'cp {self.inputpath} {self.scratch}')
+        for f in self.need_files:
+            job.append(f'cp {f} {self.scratch}')
+
+        job.append(f'cd {self.scratch}')
+        return job
+
+    def guesses(self):
+        """Directories (source, name) copied into scratch after the input files."""
+        return []
+
+    def build_run(self):
+        return []
+
+    def build_stage_out(self):
+        job = self.build_save()
+        if self.staging is not None:
+            job = self.staging.stage_out_start() + job + self.staging.stage_out_end()
+        return job
+
+    def build_save(self):
+        return [f'savefile {self.outputfile}']
 
     def write(self):
-        parent = Path(self.config.input).parent
-        jobname = Path(self.config.input).stem + self.ext
-        os.chdir(parent)
-        with open(jobname, 'w') as f:
-            f.write(str(self.config)+'\n')
-            f.write(str(self))
+        if self.staged is not None:
+            write_atomic(*self.staged)
+        write_atomic(self.jobfile, str(self.config) + '\n' + str(self))
+        if self.requeue is not None and self.restartable and not self.restart:
+            self.continuation().write()
+
+    def continuation(self):
+        """The job submitted when this one runs out of time: the same job, restarting from the state
+        saved by the timeout trap, with its input in <dest>/restart/."""
+        from requeue import RESTART, continuation_name, restart_input
+
+        if self.staged is not None:
+            text = self.staged[1]
+        else:
+            with open(self.config.input + self.config.ext_inp) as f:
+                text = f.read()
+        job = copy.copy(self)
+        job.restart = True
+        job.jobfile = str(self.dest / continuation_name(self))
+        job.stage_input(str(self.dest / RESTART / self.inputfile), restart_input(self, text))
+        job.restart_from()
+        job.job = job.build_job()
+        return job
+
+    def restart_from(self):
+        """Set up a continuation job to start from the saved state."""
+        pass
+
+    def stage_input(self, path, text):
+        """Stage an adjusted copy of the input, written to path along with the job file. The file name
+        must match the input file name, as the copy keeps it on scratch."""
+        self.staged = (path, text)
+        self.inputpath = os.path.relpath(path, self.dest)
 
     def make_test_files(self):
         pass
 
     def set_input(self, i):
-        self.inputfile = i + self.config.ext_inp
-        self.outputfile = i + self.config.ext_out
-        self.jobfile = i + self.ext
+        """Set file names from the input path (without extension). Names used on $SCRATCH are
+        plain file names, while the input is copied from its path relative to the job directory."""
+        self.stem = Path(i).name
+        self.inputfile = self.stem + self.config.ext_inp
+        self.inputpath = os.path.relpath(i + self.config.ext_inp, self.dest)
+        self.outputfile = self.stem + self.config.ext_out
+        self.jobfile = str(self.dest / (self.stem + self.ext))
 
     @staticmethod
     def load_default_environment():
-        try:
-            with open(os.path.join(ROOT, 'default_environments.json')) as f:
-                return json.loads(f.read())
-
-        except FileNotFoundError:
-            sys.exit('Error reading default environments.')
+        """The environment registry shared by all jobs (bundled defaults with site and user overrides)."""
+        return get_environments()
 
 
 class MRChemJob(Job):
-    def __init__(self, store_orbs=None, store_chk=None, init_orbs=None, init_check=None, checkout=None, json=None, version=None, **kwargs):
+    restartable = True
+
+    def __init__(self, store_orbs=None, store_chk=None, init_orbs=None, init_check=None, checkout=None, json=None, version=None,
+                 orb_store=None, orb_compress=False, **kwargs):
         self.store_orbs = store_orbs if store_orbs is not None else False
         self.store_chk = store_chk if store_chk is not None else False
         self.init_orbs = init_orbs if init_orbs is not None else False
         self.init_chk = init_check if init_check is not None else False
         self.json = json if json is not None else False
+        self.orb_store = orb_store
+        self.orb_compress = orb_compress
+
+        # Continuation jobs restart from the checkpoint
+        if kwargs.get('requeue') is not None:
+            self.store_chk = True
 
         Job.__init__(self, **kwargs)
         self.code = 'mrchem'
         self.version = version if version is not None else self.environment[self.cluster][self.code]['exe']
         self.job = self.build_job()
 
-    def build_job(self):
-        job = ['']
-        job.append('module purge')
-        for mod in self.environment[self.cluster][self.code]['modules']:
-            job.append(f'module load {mod}')
+    def guess_dirs(self):
+        job = []
+        if self.init_orbs:
+            job.append((self.init_orbs, 'initial_guess'))
+        if self.init_chk:
+            job.append((self.init_chk, 'checkpoint'))
+        return job
 
-        job.append('')
-        job.append(f'cp {self.inputfile} $SCRATCH')
+    def guesses(self):
+        return [(src, name) for src, name in self.guess_dirs() if not self.from_store(src)]
+
+    def from_store(self, src):
+        """Whether a guess is a store reference, or may be one when it is only known at runtime."""
+        from orbstore import is_reference
+        return is_reference(src) or (self.orb_store is not None and '$' in src)
+
+    def store_root(self):
+        if self.orb_store:
+            return self.orb_store
+        return f'/cluster/projects/{self.config.account}/$(whoami)/MWStore'
+
+    def build_stage_in(self):
+        job = Job.build_stage_in(self)
+        if self.staging is None:
+            for src, name in self.guesses():
+                job.append(f'cp -r {src} {name}')
+        for src, name in self.guess_dirs():
+            if self.from_store(src):
+                job.extend(self.materialise(src, name))
+        return job
 
-        for f in self.need_files:
-            job.append(f'cp {f} $SCRATCH')
+    def materialise(self, src, name):
+        from orbstore import PREFIX, is_reference
 
-        job.append('cd $SCRATCH')
-        if self.init_orbs:
-            job.append(f'cp -r {self.init_orbs} initial_guess')
-        if self.init_chk:
-            job.append(f'cp -r {self.init_chk} checkpoint')
+        # MRChem rewrites checkpoint files, so those are copied rather than linked to the store
+        copy = ' --copy' if name == 'checkpoint' else ''
+        if is_reference(src):
+            return [f'python3 {ORBSTORE} materialise {self.store_root()} {src} {name}{copy}']
+        return [f'GUESS={src}',
+                f'case $GUESS in {PREFIX}*) python3 {ORBSTORE} materialise {self.store_root()} $GUESS {name}{copy} ;; '
+                f'*) cp -r $GUESS {name} ;; esac']
 
+    def publish(self, src, ext):
+        compress = ' --compress' if self.orb_compress else ''
+        return [f'python3 {ORBSTORE} publish {self.store_root()} {src} --job ${{SLURM_JOBID}}{ext}{compress} '
+                f'> ${{SLURM_SUBMIT_DIR}}/{self.stem}{ext}']
+
+    def build_run(self):
+        job = []
         if self.config.hybrid:
             job.append(f'export OMP_NUM_THREADS={self.config.cpus}')
 
-        launcher = f'\'srun -n {self.config.ntasks}\''
-        job.append(f'{self.version} --launcher {launcher} {"--json" if self.json else ""} {Path(self.config.input).stem}')
-        job.append('')
-        job.append(f'savefile {self.outputfile}')
-        job.append(f'savefile {self.config.input}.json')
+        # With -L, ntasks counts the tasks per node
+        ntasks = total_tasks(self.config)
+        launcher = f'\'srun -n {ntasks}\''
+        if self.config.layout is not None:
+            job.extend(self.config.layout.environment())
+            launcher = f'\'srun -n {ntasks} {self.config.layout.srun_options()}\''
+        job.append(f'{self.version} --launcher {launcher} {"--json" if self.json else ""} {self.stem}')
+        return job
+
+    def build_save(self):
+        job = Job.build_save(self)
+        job.append(f'savefile {self.stem}.json')
         for f in self.save_files:
             job.append(f'savefile {Path(f).stem}')
 
-        if self.store_orbs:
+        if self.store_orbs and self.orb_store is not None:
+            job.append('')
+            job.extend(self.publish('orbitals', '.orbitals'))
+        elif self.store_orbs:
             job.append('')
             job.append(f'DIR=/cluster/projects/{self.config.account}/$(whoami)/MWOrbitals/${{SLURM_JOBID}}')
             job.append(f'mkdir -p $DIR')
-            job.append(f'cp orbitals/* $DIR/')
-            job.append(f'echo $DIR > ${{SLURM_SUBMIT_DIR}}/{Path(self.config.input).stem}.orbitals')
+            job.append(self.copy_dir('orbitals', '$DIR'))
+            job.append(f'echo $DIR > ${{SLURM_SUBMIT_DIR}}/{self.stem}.orbitals')
 
-        if self.store_chk:
+        if self.store_chk and self.orb_store is not None:
+            job.append('')
+            job.extend(self.publish('checkpoint', '.checkpoint'))
+        elif self.store_chk:
             job.append('')
             job.append(f'DIR=/cluster/projects/{self.config.account}/$(whoami)/MWCheckpoints/${{SLURM_JOBID}}')
             job.append(f'mkdir -p $DIR')
-            job.append(f'cp checkpoint/* $DIR/')
-            job.append(f'echo $DIR > ${{SLURM_SUBMIT_DIR}}/{Path(self.config.input).stem}.checkpoint')
+            job.append(self.copy_dir('checkpoint', '$DIR'))
+            job.append(f'echo $DIR > ${{SLURM_SUBMIT_DIR}}/{self.stem}.checkpoint')
+        return job
 
-        job.append('')
-        job.append('exit 0')
+    def restart_from(self):
+        self.init_orbs = False
+        self.init_chk = f'$(cat ${{SLURM_SUBMIT_DIR}}/{self.stem}.checkpoint)'
 
-        return job
+    def copy_dir(self, src, dst):
+        if self.staging is not None:
+            return self.staging.copy_dir(src, dst)
+        return f'cp {src}/* {dst}/'
 
     def make_test_files(self, fname='mrchem_test'):
         self.set_input(fname)
@@ -183,29 +348,16 @@ class GaussianJob(Job):
         self.code = 'gaussian'
         self.job = self.build_job()
 
-    def build_job(self):
-        job = ['']
-        job.append(f'module purge')
-        for mod in self.environment[self.cluster][self.code]['modules']:
-            job.append(f'module load {mod}')
-
-        job.append(f'')
-        job.append(f'cp {self.inputfile} $SCRATCH')
-
-        for f in self.need_files:
-            job.append(f'cp {f} $SCRATCH')
-
-        job.append(f'cd $SCRATCH')
+    def build_run(self):
         exe = self.environment[self.cluster][self.code]['exe']
-        job.append(f'{exe} {self.inputfile} > {self.outputfile}')
-        job.append(f'')
-        job.append(f'savefile {self.outputfile}')
-        job.append(f'savefile {self.config.input + ".chk"}')
+        job = ['export GAUSS_SCRDIR=$LOCALSCRATCH'] if self.local_scratch else []
+        return job + [f'{exe} {self.inputfile} > {self.outputfile}']
+
+    def build_save(self):
+        job = Job.build_save(self)
+        job.append(f'savefile {self.stem + ".chk"}')
         for f in self.save_files:
             job.append(f'savefile {f}')
-
-        job.append(f'')
-        job.append(f'exit 0')
         return job
 
     def make_test_files(self, fname='gaussian_test'):
@@ -236,17 +388,15 @@ class GaussianJob(Job):
             f.write('\n'.join(c.config + self.build_job()))
 
 class ORCAJob(Job):
+    restartable = True
+
     def __init__(self, **kwargs):
         Job.__init__(self, **kwargs)
         self.code = 'orca'
         self.job = self.build_job()
 
-    def build_job(self):
-        job = ['']
-        job.append(f'module purge')
-        for mod in self.environment[self.cluster][self.code]['modules']:
-            job.append(f'module load {mod}')
-
+    def build_prologue(self):
+        job = Job.build_prologue(self)
         job.append('')
         job.append(f'ORCA={self.environment[self.cluster][self.code]["exe"]}')
         job.append(f'MPI={self.environment[self.cluster][self.code]["mpi"]}')
@@ -257,25 +407,22 @@ class ORCAJob(Job):
         job.append(f'export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:$ORCA')
         job.append(f'export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:$MPI')
         job.append(f'export RSH_COMMAND="/usr/bin/ssh -x"')
+        return job
 
-        job.append(f'')
-        job.append(f'cp {self.inputfile} $SCRATCH')
-        for f in self.need_files:
-            job.append(f'cp {f} $SCRATCH')
+    def build_run(self):
+        return [f'$ORCA/orca {self.inputfile} > {self.outputfile}']
 
-        job.append(f'cd $SCRATCH')
-        job.append(f'$ORCA/orca {self.inputfile} > {self.outputfile}')
+    def restart_from(self):
+        from requeue import restart_gbw
+        self.need_files = self.need_files + [restart_gbw(self)]
 
-        job.append(f'')
-        job.append(f'savefile {self.outputfile}')
+    def build_save(self):
+        job = Job.build_save(self)
         job.append(f'savefile *.hess')
         job.append(f'savefile *.gbw')
         job.append(f'savefile *.xyz')
         for f in self.save_files:
             job.append(f'savefile {f}')
-
-        job.append(f'')
-        job.append(f'exit 0')
         return job
 
     def make_test_files(self, fname='orca_test'):
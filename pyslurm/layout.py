@@ -0,0 +1,147 @@
+import json
+import math
+import os
+import re
+
+from environment import ROOT
+
+# Node shape of the normal partition of each cluster: cores, sockets, NUMA domains and usable memory
+CLUSTERS = os.environ.get('PYSLURM_CLUSTERS', os.path.join(ROOT, 'clusters.json'))
+
+MEMORY_UNITS = {'K': 1 / 1024**2, 'M': 1 / 1024, 'G': 1.0, 'T': 1024.0}
+
+_clusters = None
+
+
+class LayoutError(ValueError):
+    pass
+
+
+def get_clusters():
+    """The node shapes, loaded once per process."""
+    global _clusters
+    if _clusters is None:
+        try:
+            with open(CLUSTERS) as f:
+                _clusters = json.load(f)
+        except (OSError, ValueError) as e:
+            raise LayoutError(f'Error reading cluster data {CLUSTERS}: {e}')
+    return _clusters
+
+
+def memory_gb(s):
+    """GB from a SLURM memory value such as 500MB or 140GB."""
+    m = re.match(r'\s*([0-9.]+)\s*([KMGT]?)B?\s*$', str(s), re.IGNORECASE)
+    if not m:
+        raise LayoutError(f'Invalid memory: {s}')
+    return float(m.group(1)) * MEMORY_UNITS[m.group(2).upper() or 'M']
+
+
+class Layout:
+    """Nodes, MPI tasks per node and OpenMP threads per task, with the memory per node (GB)."""
+    def __init__(self, nodes, tasks_per_node, threads, memory):
+        self.nodes = nodes
+        self.tasks_per_node = tasks_per_node
+        self.threads = threads
+        self.memory = memory
+
+    @property
+    def ntasks(self):
+        return self.nodes * self.tasks_per_node
+
+    def environment(self):
+        """Thread pinning for the job script: threads stay on the cores of their task."""
+        if self.threads == 1:
+            return []
+        return ['export OMP_PLACES=cores', 'export OMP_PROC_BIND=close']
+
+    def srun_options(self):
+        # Tasks get consecutive cores, so a task never straddles a NUMA domain when its threads divide one
+        return '--cpu-bind=cores --distribution=block:block'
+
+    def __str__(self):
+        return (f'{self.nodes} node(s) x {self.tasks_per_node} task(s) x {self.threads} thread(s), '
+                f'{self.memory}GB per node')
+
+
+def plan(cluster, code, cores, memory=None):
+    """Choose a layout for a total number of cores and, optionally, total memory (GB) on the nodes of cluster.
+    MRChem gets one task per NUMA domain (or a divisor of it for small jobs), ORCA one thread per task
+    and Gaussian a single task with the requested cores (all cores of the node on whole-node clusters). Nodes are added until both targets fit."""
+    node = get_clusters()[cluster]
+    node_memory = memory_gb(node['memory'])
+    domain = node['cores'] // node['numa']
+
+    if code == 'gaussian':
+        if cores > node['cores'] or (memory or 0) > node_memory:
+            raise LayoutError(f'Gaussian runs on a single node ({node["cores"]} cores, {node["memory"]} on {cluster})')
+        threads = cores
+    elif code == 'orca':
+        threads = 1
+    else:
+        threads = max(d for d in range(1, domain + 1) if domain % d == 0 and d <= max(cores, 1))
+
+    tasks = math.ceil(cores / threads)
+    nodes = max(math.ceil(tasks * threads / node['cores']), math.ceil((memory or 0) / node_memory), 1)
+    if code == 'gaussian':
+        # A single process, with all cores of a whole node as threads
+        tasks_per_node = 1
+        threads = node['cores'] if node['whole_nodes'] else threads
+    elif node['whole_nodes']:
+        tasks_per_node = node['cores'] // threads
+    else:
+        tasks_per_node = math.ceil(tasks / nodes)
+
+    if memory is None:
+        memory = node_memory * nodes if node['whole_nodes'] else node_memory * tasks_per_node * threads / node['cores'] * nodes
+    return Layout(nodes, tasks_per_node, threads, math.ceil(memory / nodes))
+
+
+def plan_config(config, code, cores=None):
+    """Replace the parallel scheme of config with a planned layout. The target is the given number of cores
+    (default: all cores requested by config) and the requested memory, taken as the total. Returns the layout."""
+    nodes = int(config.nodes) if config.loc else 1
+    if cores is None:
+        cores = int(config.ntasks) * (int(config.cpus) if config.hybrid else 1) * nodes
+    memory = memory_gb(config.memory)
+    memory = memory * nodes if config.memtype == 'tot' else memory * cores
+
+    layout = plan(config.cluster, code, cores, memory)
+    config.layout = layout
+    config.nodes = str(layout.nodes)
+    config.ntasks = str(layout.ntasks)
+    config.cpus = str(layout.threads)
+    config.hybrid = layout.threads > 1
+    config.loc = False
+    config.memory = f'{layout.memory}GB'
+    config.memtype = 'tot'
+    config.build_config()
+    return layout
+
+
+def cores_per_node(config):
+    """CPUs config needs on every node: all tasks per node with -L or a layout, a single task otherwise."""
+    threads = int(config.cpus) if config.hybrid else 1
+    if config.layout is not None:
+        return config.layout.tasks_per_node * config.layout.threads
+    if config.loc:
+        return int(config.ntasks) * threads
+    return threads
+
+
+def check_config(config):
+    """Reject requests that cannot fit the nodes of the normal partition: more memory or CPUs per node
+    than a node has. Clusters without node data and other partitions are not checked."""
+    if config.partition.lower() != 'normal' or config.cluster not in get_clusters():
+        return
+    node = get_clusters()[config.cluster]
+    cores = cores_per_node(config)
+    if cores > node['cores']:
+        raise LayoutError(f'{cores} CPUs per node requested, but {config.cluster} nodes have {node["cores"]} cores')
+
+    # Memory is not requested on fram unless a layout was planned
+    if config.cluster == 'fram' and config.layout is None:
+        return
+    memory = memory_gb(config.memory) * (cores if config.memtype == 'cpu' else 1)
+    if memory > memory_gb(node['memory']):
+        raise LayoutError(f'{memory:g}GB per node requested, but {config.cluster} nodes have {node["memory"]} usable')
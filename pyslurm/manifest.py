@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+from jobs import write_atomic
+
+# Per directory record of the generated job files
+NAME = '.pyslurm-manifest.json'
+
+_manifests = {}
+
+
+def sha256(data):
+    return hashlib.sha256(data if isinstance(data, bytes) else data.encode()).hexdigest()
+
+
+def job_digest(job):
+    """Hashes of everything a job file is generated from: the input, the effective configuration,
+    the environment entry of the code, and the rendered script (with the staged input, if any)."""
+    try:
+        with open(job.config.input + job.config.ext_inp, 'rb') as f:
+            inp = sha256(f.read())
+    except OSError:
+        inp = None
+    environment = job.environment.get(job.cluster, {}).get(job.code, {}) if job.code is not None else {}
+    script = str(job.config) + '\n' + str(job) + (job.staged[1] if job.staged is not None else '')
+
+    digest = {'input': inp,
+              'config': sha256(json.dumps(job.config.to_dict(), sort_keys=True, default=str)),
+              'environment': sha256(json.dumps(environment, sort_keys=True)),
+              'script': sha256(script)}
+    digest['hash'] = sha256(''.join(str(digest[k]) for k in sorted(digest)))
+    return digest
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return sha256(f.read())
+    except OSError:
+        return None
+
+
+class Manifest:
+    """Hashes of the job files in a directory as last written, and of their last submission."""
+    def __init__(self, directory):
+        self.path = os.path.join(directory, NAME)
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def state(self, jobfile, digest):
+        """'new' (not on disk), 'unchanged', 'edited' (changed on disk since it was written, or not
+        written by pyslurm) or 'changed'."""
+        entry = self.entries.get(os.path.basename(jobfile))
+        on_disk = file_hash(jobfile)
+        if on_disk is None:
+            return 'new'
+        if entry is None or on_disk != entry['file']:
+            return 'edited'
+        return 'unchanged' if entry['hash'] == digest['hash'] else 'changed'
+
+    def changes(self, jobfile, digest):
+        """Names of the parts that changed since the job file was last written."""
+        entry = self.entries.get(os.path.basename(jobfile))
+        if entry is None:
+            return []
+        return [k for k in ['input', 'config', 'environment', 'script'] if entry.get(k) != digest[k]]
+
+    def describe(self, jobfile, digest, state):
+        if state == 'changed':
+            return f'changed ({", ".join(self.changes(jobfile, digest))})'
+        if state == 'edited' and os.path.basename(jobfile) not in self.entries:
+            return 'not in the manifest (written by hand?), not overwritten without -f'
+        if state == 'edited':
+            return 'edited since it was written, not overwritten without -f'
+        return state
+
+    def record(self, jobfile, digest):
+        entry = self.entries.setdefault(os.path.basename(jobfile), {})
+        entry.update(digest)
+        entry['file'] = file_hash(jobfile)
+        self.dirty = True
+
+    def needs_submit(self, jobfile):
+        """Whether the job file changed since its last recorded submission (or was never submitted)."""
+        entry = self.entries.get(os.path.basename(jobfile))
+        return entry is None or entry.get('submitted', {}).get('hash') != entry['hash']
+
+    def record_submission(self, jobfile, jobid):
+        entry = self.entries.get(os.path.basename(jobfile))
+        if entry is not None:
+            entry['submitted'] = {'hash': entry['hash'], 'jobid': jobid}
+            self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            write_atomic(self.path, json.dumps(self.entries, indent=1, sort_keys=True))
+            self.dirty = False
+
+
+def manifest_for(jobfile):
+    """The manifest of the directory of jobfile, loaded once per process."""
+    directory = os.path.dirname(os.path.abspath(jobfile))
+    if directory not in _manifests:
+        _manifests[directory] = Manifest(directory)
+    return _manifests[directory]
+
+
+def record_submissions(records):
+    """Record the job IDs of submitted job files in their manifests."""
+    for r in records:
+        if r['jobid'] is not None:
+            manifest_for(r['jobfile']).record_submission(r['jobfile'], r['jobid'])
+    save_manifests()
+
+
+def save_manifests():
+    for manifest in _manifests.values():
+        manifest.save()
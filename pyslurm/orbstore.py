@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Content-addressed, deduplicated store for MRChem orbitals and checkpoints.
+
+Layout of a store:
+    objects/<ab>/<sha256>[.gz]   file contents, stored once and read-only
+    manifests/<id>.json          relative path -> [sha256, size, compressed] of one directory
+    index/<job>                  manifest id published by a job
+
+Runs on the compute nodes from the generated job scripts, so it only uses the standard library.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PREFIX = 'orbstore:'
+CHUNK = 1 << 20
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_reference(s):
+    return isinstance(s, str) and s.startswith(PREFIX)
+
+
+class OrbitalStore:
+    def __init__(self, root):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.manifests = os.path.join(root, 'manifests')
+        self.index = os.path.join(root, 'index')
+
+    def object_path(self, digest, compressed=False):
+        return os.path.join(self.objects, digest[:2], digest + ('.gz' if compressed else ''))
+
+    def _write(self, path, write):
+        """Write through a temporary file and rename, so readers never see partial files."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def put(self, path, compress=False):
+        """Add a file to the store unless identical content is already there. Returns (sha256, size, compressed)."""
+        digest = file_hash(path)
+        size = os.path.getsize(path)
+        for compressed in [False, True]:
+            if os.path.exists(self.object_path(digest, compressed)):
+                return digest, size, compressed
+
+        target = self.object_path(digest, compress)
+
+        def write(out):
+            with open(path, 'rb') as f:
+                if compress:
+                    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=1) as z:
+                        shutil.copyfileobj(f, z, CHUNK)
+                else:
+                    shutil.copyfileobj(f, out, CHUNK)
+
+        self._write(target, write)
+        os.chmod(target, 0o444)
+        return digest, size, compress
+
+    def publish(self, src, job=None, compress=False, workers=8):
+        """Store all files below src and record them in a manifest. Identical directories share
+        the manifest. Returns the manifest id."""
+        paths = sorted(os.path.relpath(os.path.join(d, f), src) for d, _, files in os.walk(src) for f in files)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            entries = list(pool.map(lambda p: self.put(os.path.join(src, p), compress), paths))
+
+        files = {p: list(e) for p, e in zip(paths, entries)}
+        text = json.dumps(files, sort_keys=True).encode()
+        manifest = hashlib.sha256(text).hexdigest()[:16]
+        path = os.path.join(self.manifests, manifest + '.json')
+        if not os.path.exists(path):
+            self._write(path, lambda f: f.write(text))
+
+        if job is not None:
+            self._write(os.path.join(self.index, str(job)), lambda f: f.write(manifest.encode()))
+        return manifest
+
+    def read_manifest(self, manifest):
+        with open(os.path.join(self.manifests, manifest + '.json')) as f:
+            return json.load(f)
+
+    def materialise(self, manifest, dest, link=True, workers=8):
+        """Recreate the directory of a manifest at dest, with hard links to the (read-only) objects
+        where possible and parallel copies otherwise. Use link=False for files that will be written to."""
+        files = self.read_manifest(manifest)
+
+        def restore(item):
+            path, (digest, _, compressed) = item
+            target = os.path.join(dest, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            source = self.object_path(digest, compressed)
+            if compressed:
+                with gzip.open(source, 'rb') as f, open(target, 'wb') as out:
+                    shutil.copyfileobj(f, out, CHUNK)
+                return
+            if link:
+                try:
+                    os.link(source, target)
+                    return
+                except OSError:
+                    pass
+            shutil.copyfile(source, target)
+
+        os.makedirs(dest, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(restore, files.items()))
+
+    def forget(self, job):
+        os.remove(os.path.join(self.index, str(job)))
+
+    def gc(self, grace=24 * 3600, dry_run=False):
+        """Remove manifests no job refers to and objects no manifest refers to. Files younger than
+        grace seconds are kept, since a job may be publishing them right now.
+        Returns (manifests, objects, bytes) removed."""
+        now = time.time()
+
+        def old(path):
+            return now - os.path.getmtime(path) > grace
+
+        referenced = set()
+        if os.path.isdir(self.index):
+            for job in os.listdir(self.index):
+                with open(os.path.join(self.index, job)) as f:
+                    referenced.add(f.read().strip())
+
+        removed_manifests = 0
+        live = set()
+        if os.path.isdir(self.manifests):
+            for name in os.listdir(self.manifests):
+                manifest, path = name[:-len('.json')], os.path.join(self.manifests, name)
+                if not name.endswith('.json'):
+                    continue
+                if manifest in referenced or not old(path):
+                    live.update(entry[0] for entry in self.read_manifest(manifest).values())
+                    continue
+                removed_manifests += 1
+                if not dry_run:
+                    os.remove(path)
+
+        removed_objects, removed_bytes = 0, 0
+        for d, _, files in os.walk(self.objects):
+            for name in files:
+                path = os.path.join(d, name)
+                digest = name[:-len('.gz')] if name.endswith('.gz') else name
+                if digest in live or name.startswith('.tmp') or not old(path):
+                    continue
+                removed_objects += 1
+                removed_bytes += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+        return removed_manifests, removed_objects, removed_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='orbstore', description='Content-addressed store for MRChem orbitals and checkpoints.')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    p = sub.add_parser('publish', help='Store a directory and print its reference.')
+    p.add_argument('store')
+    p.add_argument('src')
+    p.add_argument('--job', type=str, help='Job the manifest is indexed under.')
+    p.add_argument('--compress', action='store_true', help='Store new objects gzip compressed.')
+    p.add_argument('--workers', default=8, type=int)
+
+    p = sub.add_parser('materialise', help='Recreate a stored directory.')
+    p.add_argument('store')
+    p.add_argument('ref', help='orbstore:<id> or manifest id')
+    p.add_argument('dest')
+    p.add_argument('--copy', action='store_true', help='Copy instead of hard linking (for files that are written to).')
+    p.add_argument('--workers', default=8, type=int)
+
+    p = sub.add_parser('forget', help='Drop the index entry of a job.')
+    p.add_argument('store')
+    p.add_argument('job')
+
+    p = sub.add_parser('gc', help='Remove unreferenced manifests and objects.')
+    p.add_argument('store')
+    p.add_argument('--grace', default=24, type=float, help='Keep files younger than this many hours.')
+    p.add_argument('-n', '--dry-run', action='store_true')
+
+    args = parser.parse_args(argv)
+    store = OrbitalStore(args.store)
+
+    if args.command == 'publish':
+        print(PREFIX + store.publish(args.src, job=args.job, compress=args.compress, workers=args.workers))
+    elif args.command == 'materialise':
+        ref = args.ref[len(PREFIX):] if is_reference(args.ref) else args.ref
+        store.materialise(ref, args.dest, link=not args.copy, workers=args.workers)
+    elif args.command == 'forget':
+        store.forget(args.job)
+    elif args.command == 'gc':
+        manifests, objects, nbytes = store.gc(grace=args.grace * 3600, dry_run=args.dry_run)
+        print(f'{"Would remove" if args.dry_run else "Removed"} {manifests} manifests and {objects} objects ({nbytes / 1024**3:.2f} GB)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import json
+import os
+import re
+
+# Wall time as printed at the end of an output file, per code
+ORCA_TIME = re.compile(r'TOTAL RUN TIME:\s*(\d+)\s*days\s*(\d+)\s*hours\s*(\d+)\s*minutes\s*(\d+)\s*seconds\s*(\d+)\s*msec')
+GAUSSIAN_TIME = re.compile(r'Elapsed time:\s*(\d+)\s*days\s*(\d+)\s*hours\s*(\d+)\s*minutes\s*([0-9.]+)\s*seconds')
+MRCHEM_TIME = re.compile(r'Wall time\s*:\s*(?:(\d+)h)?\s*(?:(\d+)m)?\s*([0-9.]+)\s*s', re.IGNORECASE)
+
+# Final energies (Hartree). Gaussian prints the energy of the last step in the archive entry at the end,
+# wrapped over lines, and SCF Done for every SCF.
+ORCA_ENERGY = re.compile(r'FINAL SINGLE POINT ENERGY\s+(-?\d+\.\d+)')
+GAUSSIAN_ARCHIVE_ENERGY = re.compile(r'\\HF=(-?\d+\.\d+)')
+GAUSSIAN_ENERGY = re.compile(r'SCF Done:\s+E\(\S+\)\s*=\s*(-?\d+\.\d+)')
+MRCHEM_ENERGY = re.compile(r'Total energy\s*(?:\(au\))?\s*:?\s*(-?\d+\.\d+(?:[eE][+-]?\d+)?)')
+
+# Banners identifying the code that wrote an output, found in its first lines
+BANNERS = [('gaussian', re.compile(r'Entering Gaussian System|Gaussian, Inc')),
+           ('mrchem', re.compile(r'MRChem', re.IGNORECASE)),
+           ('orca', re.compile(r'O\s+R\s+C\s+A|\bORCA\b'))]
+
+# Bytes read from the start and the end of output files, which can be very large
+HEAD = 8 * 1024
+TAIL = 64 * 1024
+
+
+def read_head(path, size=HEAD):
+    with open(path, 'rb') as f:
+        return f.read(size).decode(errors='replace')
+
+
+def read_tail(path, size=TAIL):
+    """The last size bytes of a file as text."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        return f.read().decode(errors='replace')
+
+
+def orca_seconds(text):
+    matches = ORCA_TIME.findall(text)
+    if not matches:
+        return None
+    d, h, m, s, ms = (int(x) for x in matches[-1])
+    return d * 86400 + h * 3600 + m * 60 + s + ms / 1000
+
+
+def gaussian_seconds(text):
+    """Sum of the elapsed times of the job steps in text."""
+    matches = GAUSSIAN_TIME.findall(text)
+    if not matches:
+        return None
+    return sum(int(d) * 86400 + int(h) * 3600 + int(m) * 60 + float(s) for d, h, m, s in matches)
+
+
+def mrchem_seconds(text):
+    matches = MRCHEM_TIME.findall(text)
+    if not matches:
+        return None
+    h, m, s = matches[-1]
+    return int(h or 0) * 3600 + int(m or 0) * 60 + float(s)
+
+
+SECONDS = {'orca': orca_seconds, 'gaussian': gaussian_seconds, 'mrchem': mrchem_seconds}
+
+
+def identify(head):
+    """Code that wrote the output starting with head, or None."""
+    for code, banner in BANNERS:
+        if banner.search(head):
+            return code
+    return None
+
+
+def final_energy(code, text):
+    """Last energy printed in text (the end of an output), or None."""
+    if code == 'gaussian':
+        matches = GAUSSIAN_ARCHIVE_ENERGY.findall(text.replace('\n ', '')) or GAUSSIAN_ENERGY.findall(text)
+    else:
+        matches = {'orca': ORCA_ENERGY, 'mrchem': MRCHEM_ENERGY}.get(code, ORCA_ENERGY).findall(text)
+    return float(matches[-1]) if matches else None
+
+
+def orca_wall_time(path):
+    return orca_seconds(read_tail(path))
+
+
+def gaussian_wall_time(path):
+    """Sum of the elapsed times of all job steps, so the whole file is scanned."""
+    total, found = 0.0, False
+    with open(path, errors='replace') as f:
+        for line in f:
+            if 'Elapsed time' in line:
+                seconds = gaussian_seconds(line)
+                if seconds is not None:
+                    total += seconds
+                    found = True
+    return total if found else None
+
+
+def mrchem_wall_time(path):
+    return mrchem_seconds(read_tail(path))
+
+
+def timing_wall_time(path):
+    """Duration of the run phase of the last job recorded in an --instrument timing file."""
+    start, end = {}, {}
+    with open(path) as f:
+        for line in f:
+            try:
+                m = json.loads(line)
+            except ValueError:
+                continue
+            if m.get('phase') == 'run':
+                (start if m['event'] == 'start' else end)[m['job']] = m['time']
+    done = [job for job in end if job in start]
+    return end[done[-1]] - start[done[-1]] if done else None
+
+
+WALL_TIME = {'orca': orca_wall_time, 'gaussian': gaussian_wall_time, 'mrchem': mrchem_wall_time}
+
+
+def wall_time(directory, stem, code, ext_out='.out'):
+    """Wall time (s) of the calculation <stem> in directory: from the timing file of an instrumented
+    job, if there is one, else from the end of the output. None if not (yet) available."""
+    candidates = [(timing_wall_time, os.path.join(directory, stem + '.timing'))]
+    if code in WALL_TIME:
+        candidates.append((WALL_TIME[code], os.path.join(directory, stem + ext_out)))
+    for read, path in candidates:
+        try:
+            seconds = read(path)
+        except OSError:
+            continue
+        if seconds is not None:
+            return seconds
+    return None
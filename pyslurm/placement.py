@@ -0,0 +1,317 @@
+import heapq
+import math
+import os
+import shlex
+import subprocess
+
+from autotune import parse_elapsed
+from layout import LayoutError, cores_per_node, get_clusters, memory_gb
+from status import hms
+
+# Queries of a cluster snapshot. Snapshot files are named <cluster>.<tool> and hold the output of these.
+QUERIES = {'sinfo': "sinfo -h -o '%R %a %l %D %c %m %C'",
+           'squeue': "squeue -h -t PENDING,RUNNING -o '%i %P %q %T %C %L %l %Q'",
+           'sprio': "sprio -h -o '%i %Y'"}
+
+# Partitions considered. devel is the devel QOS on the nodes of the normal partition.
+PARTITIONS = ['normal', 'bigmem', 'devel']
+
+# Preference between partitions with the same estimated start (and CPUs allocated): the scarce
+# bigmem nodes last
+PREFERENCE = ['normal', 'devel', 'bigmem']
+
+# Time assumed for jobs without a time limit (or time left) in the snapshot
+UNKNOWN_TIME = 86400
+
+
+class PlacementError(ValueError):
+    pass
+
+
+def parse_time(s, default=UNKNOWN_TIME):
+    """Seconds from a SLURM time, or default for UNLIMITED, NOT_SET and the like."""
+    try:
+        return parse_elapsed(s)
+    except ValueError:
+        return default
+
+
+def run_query(cluster, tool, command=None):
+    """Output of a query of cluster. With command (e.g. 'ssh {cluster}.sigma2.no', or a stand-in script),
+    the query is appended to it. Returns None if the query failed."""
+    cmd = shlex.split(command.replace('{cluster}', cluster)) if command is not None else []
+    try:
+        p = subprocess.run(cmd + shlex.split(QUERIES[tool]), capture_output=True, text=True)
+    except OSError:
+        return None
+    return p.stdout if p.returncode == 0 else None
+
+
+def read_snapshot(cluster, snapshots=None, command=None):
+    """The sinfo, squeue and sprio output of cluster by tool, from <snapshots>/<cluster>.<tool> or queried.
+    Returns None if there is no sinfo output. sprio is optional, squeue priorities are used without it."""
+    snapshot = {}
+    for tool in QUERIES:
+        if snapshots is not None:
+            try:
+                with open(os.path.join(snapshots, f'{cluster}.{tool}')) as f:
+                    snapshot[tool] = f.read()
+            except OSError:
+                snapshot[tool] = None
+        else:
+            snapshot[tool] = run_query(cluster, tool, command)
+    if snapshot['sinfo'] is None:
+        return None
+    return snapshot
+
+
+class Partition:
+    """Nodes of a partition in a snapshot: the largest node shape, and the idle and usable CPUs."""
+    def __init__(self, cluster, name):
+        self.cluster = cluster
+        self.name = name
+        self.up = False
+        self.limit = 0
+        self.nodes = 0
+        self.cpus_per_node = 0
+        self.memory_per_node = 0
+        self.idle = 0
+        self.total = 0
+        self.qos = None
+        self.running = []
+        self.pending = []
+
+    @property
+    def label(self):
+        return f'{self.cluster}/{self.name}'
+
+
+def parse_sinfo(cluster, text):
+    """Partitions by name, from lines '%R %a %l %D %c %m %C' (one per group of alike nodes)."""
+    partitions = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 7:
+            continue
+        name, avail, limit, nodes, cpus, memory, states = parts
+        try:
+            allocated, idle, other, total = [int(n) for n in states.split('/')]
+            p = partitions.setdefault(name, Partition(cluster, name))
+            p.up = p.up or avail == 'up'
+            p.limit = max(p.limit, parse_time(limit, math.inf))
+            p.nodes += int(nodes)
+            p.cpus_per_node = max(p.cpus_per_node, int(cpus.rstrip('+')))
+            p.memory_per_node = max(p.memory_per_node, int(memory.rstrip('+')) / 1024)
+        except ValueError:
+            continue
+        p.idle += idle
+        p.total += total - other
+    return partitions
+
+
+def parse_jobs(squeue, sprio=None):
+    """(partitions, qos, state, cpus, seconds, priority) of the queued jobs, from lines
+    '%i %P %q %T %C %L %l %Q'. seconds is the time left of running jobs and the time limit of pending
+    ones. Priorities are taken from sprio where it lists the job."""
+    priorities = {}
+    for line in (sprio or '').splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            try:
+                priorities[parts[0]] = float(parts[1])
+            except ValueError:
+                pass
+
+    jobs = []
+    for line in (squeue or '').splitlines():
+        parts = line.split()
+        if len(parts) != 8:
+            continue
+        jobid, partitions, qos, state, cpus, left, limit, priority = parts
+        try:
+            cpus = int(cpus)
+            priority = priorities.get(jobid, float(priority))
+        except ValueError:
+            continue
+        seconds = parse_time(left if state != 'PENDING' else limit)
+        jobs.append((partitions.split(','), qos, state, cpus, seconds, priority))
+    return jobs
+
+
+def candidates(cluster, snapshot, names=None):
+    """Candidate partitions of a cluster with their running and pending jobs. devel is the normal partition
+    limited to the devel walltime, and competing only with the pending devel jobs."""
+    names = names if names is not None else PARTITIONS
+    partitions = parse_sinfo(cluster, snapshot['sinfo'])
+    jobs = parse_jobs(snapshot['squeue'], snapshot.get('sprio'))
+
+    result = []
+    for name in names:
+        base = partitions.get('normal' if name == 'devel' else name)
+        if base is None:
+            continue
+        p = Partition(cluster, name)
+        for key in ['up', 'limit', 'nodes', 'cpus_per_node', 'memory_per_node', 'idle', 'total']:
+            setattr(p, key, getattr(base, key))
+        if name == 'devel':
+            devel = get_clusters().get(cluster, {}).get('devel_time')
+            if devel is None:
+                continue
+            p.limit = min(p.limit, parse_elapsed(devel))
+            p.qos = 'devel'
+
+        for partitions_of_job, qos, state, cpus, seconds, priority in jobs:
+            if base.name not in partitions_of_job:
+                continue
+            if state in ['RUNNING', 'COMPLETING']:
+                p.running.append((seconds, cpus))
+            elif state == 'PENDING' and (name != 'devel' or qos == 'devel'):
+                p.pending.append((priority, cpus, seconds))
+        result.append(p)
+    return result
+
+
+class Request:
+    """Resources of a job as seen by the scheduler: CPUs in total and per node, memory per node (GB) and
+    walltime (s). Clusters allocating whole nodes count the CPUs of whole nodes."""
+    def __init__(self, config):
+        from sweep import point_cores
+
+        self.cores = point_cores(config)
+        self.cores_per_node = cores_per_node(config)
+        memory = memory_gb(config.memory)
+        self.memory_per_node = memory * self.cores_per_node if config.memtype == 'cpu' else memory
+        self.seconds = parse_elapsed(config.timelimit)
+
+    def cpus(self, partition):
+        node = get_clusters().get(partition.cluster, {})
+        if node.get('whole_nodes') and partition.cpus_per_node:
+            return math.ceil(self.cores / partition.cpus_per_node) * partition.cpus_per_node
+        return self.cores
+
+    def __str__(self):
+        return f'{self.cores} cores, {self.memory_per_node:g}GB per node, {hms(self.seconds)}'
+
+
+def ineligible(partition, request):
+    """Why the request cannot run in partition, or None if it can."""
+    if not partition.up:
+        return 'partition is down'
+    if request.seconds > partition.limit:
+        return f'walltime over the limit of {hms(partition.limit)}'
+    if request.cores_per_node > partition.cpus_per_node:
+        return f'{request.cores_per_node} CPUs per node, nodes have {partition.cpus_per_node}'
+    if request.memory_per_node > partition.memory_per_node:
+        return f'{request.memory_per_node:g}GB per node, nodes have {partition.memory_per_node:g}GB'
+    if request.cpus(partition) > partition.total:
+        return f'{request.cpus(partition)} CPUs, the partition has {partition.total} usable'
+    return None
+
+
+def estimate_start(partition, request):
+    """Seconds until the job would start (None if it would not start with the jobs in the snapshot), and
+    the number of pending jobs ahead of it. The new job is taken to get the median priority, so the pending
+    jobs with at least that priority (ties included) start first, in priority order, each as soon as enough
+    CPUs are idle; running jobs free their CPUs at the end of their time left. Backfill is not modelled, so estimates err on the late side."""
+    priorities = sorted(priority for priority, _, _ in partition.pending)
+    median = priorities[len(priorities) // 2] if priorities else 0
+    ahead = sorted((job for job in partition.pending if job[0] >= median), key=lambda job: -job[0])
+
+    free, now = partition.idle, 0
+    releases = list(partition.running)
+    heapq.heapify(releases)
+
+    def start(cpus):
+        nonlocal free, now
+        while free < cpus:
+            if not releases:
+                return None
+            end, freed = heapq.heappop(releases)
+            now = max(now, end)
+            free += freed
+        return now
+
+    for _, cpus, seconds in ahead:
+        if cpus > partition.total or start(cpus) is None:
+            continue
+        free -= cpus
+        heapq.heappush(releases, (now + seconds, cpus))
+    return start(request.cpus(partition)), len(ahead)
+
+
+def place(config, clusters, partitions=None, snapshots=None, command=None):
+    """Estimate the start of the job of config on every eligible partition of the clusters with a snapshot.
+    Returns the partition with the earliest start, the start (s) and the explanation, line by line. Equal
+    starts go to the partition allocating the fewest CPUs (whole nodes on fram and betzy), then by PREFERENCE."""
+    request = Request(config)
+    lines = [f'Placement of {request} (pending jobs at or above the median priority start first, no backfill):']
+    best = None
+    for cluster in clusters:
+        snapshot = read_snapshot(cluster, snapshots, command)
+        if snapshot is None:
+            lines.append(f'  {cluster:<16}no snapshot')
+            continue
+        found = candidates(cluster, snapshot, partitions)
+        if not found:
+            lines.append(f'  {cluster:<16}none of the partitions {", ".join(partitions or PARTITIONS)}')
+        for p in found:
+            reason = ineligible(p, request)
+            if reason is not None:
+                lines.append(f'  {p.label:<16}not eligible: {reason}')
+                continue
+            seconds, ahead = estimate_start(p, request)
+            if seconds is None:
+                lines.append(f'  {p.label:<16}would not start ({p.idle} of {p.total} CPUs idle, nothing running)')
+                continue
+            start = 'now' if seconds == 0 else f'in {hms(seconds)}'
+            lines.append(f'  {p.label:<16}start {start:<14}{ahead} pending ahead, {len(p.running)} running, '
+                         f'{p.idle} of {p.total} CPUs idle')
+            key = (seconds, request.cpus(p), PREFERENCE.index(p.name))
+            if best is None or key < best[2]:
+                best = (p, seconds, key)
+    if best is None:
+        raise PlacementError('\n'.join(lines + ['No cluster and partition can run the job.']))
+    lines.append(f'Chosen: {best[0].label}, estimated start {"now" if best[1] == 0 else "in " + hms(best[1])}')
+    return best[0], best[1], lines
+
+
+def apply_placement(config, partition):
+    """Point config at the chosen cluster and partition (or the devel QOS)."""
+    config.cluster = partition.cluster
+    config.partition = 'Normal' if partition.name in ['normal', 'devel'] else partition.name
+    config.dev = partition.qos == 'devel'
+    config.qos = 'devel' if config.dev else None
+    config.build_config()
+    return config
+
+
+def place_from_args(config, args):
+    """Place config on the cluster and partition with the earliest estimated start, from --snapshots or
+    queries (--snapshot-cmd, or sinfo/squeue/sprio of the cluster pyslurm runs on).
+    Returns the explanation of the estimates."""
+    from config import hostname_cluster
+
+    partitions = args.placement_partitions.split(',') if args.placement_partitions is not None else None
+    unknown = [p for p in partitions or [] if p not in PARTITIONS]
+    if unknown:
+        raise PlacementError(f'Unknown partition: {", ".join(unknown)} (one of {", ".join(PARTITIONS)})')
+
+    command = args.snapshot_cmd if args.snapshot_cmd is not None else os.environ.get('PYSLURM_SNAPSHOT_CMD')
+    clusters = args.placement_clusters.split(',') if args.placement_clusters is not None else list(get_clusters())
+    unknown = [c for c in clusters if c not in get_clusters()]
+    if unknown:
+        raise PlacementError(f'Unknown cluster: {", ".join(unknown)} (one of {", ".join(get_clusters())})')
+
+    # Without snapshots or a query command only the queue of this cluster can be read
+    if args.snapshots is None and command is None:
+        here = hostname_cluster()
+        if here is None or (args.placement_clusters is not None and clusters != [here]):
+            raise PlacementError('Queues of other clusters need snapshots (--snapshots) or a query command (--snapshot-cmd)')
+        clusters = [here]
+
+    try:
+        partition, _, lines = place(config, clusters, partitions, args.snapshots, command)
+    except LayoutError as e:
+        raise PlacementError(str(e))
+    apply_placement(config, partition)
+    return '\n'.join(lines)
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 
+import importlib
 import os
 import sys
-import subprocess
 
-from config import Config
-from jobs import Job, MRChemJob, GaussianJob, ORCAJob, resolve_code
 from cli import cli
 
 AFFIRMATIVE = ['', 'y', 'yes']
+CODE_NAMES = {'gaussian': 'Gaussian', 'orca': 'ORCA', 'mrchem': 'MRChem'}
+
+# Subcommands (pyslurm.py <command> ...) handled by the main() of their own modules
+COMMANDS = {'orbstore': 'orbstore', 'report': 'report', 'speedup': 'sweep', 'status': 'status', 'workflow': 'workflow'}
 
 
 def debug(s, do=False):
@@ -16,40 +18,126 @@ def debug(s, do=False):
         sys.stdout.write(s+'\n')
 
 
+def write_job(job, args):
+    """Write job file, asking before overwriting an existing file unless forced."""
+    if os.path.exists(job.jobfile):
+        if args.force:
+            job.write()
+            debug(f'File written to {job.jobfile}', args.verbose)
+        else:
+            if input(f'Job file <{job.jobfile}> exists. Overwrite? ([y]/n) ') in AFFIRMATIVE:
+                job.write()
+                debug(f'File written to {job.jobfile}', args.verbose)
+            else:
+                sys.exit('Aborted')
+    else:
+        job.write()
+        debug(f'File written to {job.jobfile}', args.verbose)
+
+
+def write_incremental(job, args):
+    """Write the job file only if anything it is generated from changed since the manifest of its
+    directory was last updated. Returns whether the job should be submitted."""
+    from manifest import job_digest, manifest_for
+
+    manifest = manifest_for(job.jobfile)
+    digest = job_digest(job)
+    state = manifest.state(job.jobfile, digest)
+    if args.dry_run:
+        print(f'{job.jobfile}: {manifest.describe(job.jobfile, digest, state)}')
+        return False
+    if state == 'edited' and not args.force:
+        sys.exit(f'{job.jobfile}: {manifest.describe(job.jobfile, digest, state)}')
+    if state != 'unchanged':
+        description = manifest.describe(job.jobfile, digest, state)
+        job.write()
+        manifest.record(job.jobfile, digest)
+        manifest.save()
+        debug(f'File written to {job.jobfile} ({description})', args.verbose)
+    else:
+        debug(f'{job.jobfile} unchanged', args.verbose)
+    return manifest.needs_submit(job.jobfile)
+
+
+def submit(jobfiles, args):
+    """Submit job files and report the job IDs. Exits with an error if any submission failed."""
+    from submit import submit_jobs
+
+    debug('Submitting to queue...', args.verbose)
+    records = submit_jobs(jobfiles, args)
+    if args.incremental:
+        from manifest import record_submissions
+        record_submissions(records)
+    failed = [r for r in records if r['jobid'] is None]
+    for r in records:
+        if r['jobid'] is not None and len(records) == 1:
+            print(r['output'])
+        elif r['jobid'] is not None:
+            debug(f'{r["jobfile"]}: {r["jobid"]}', args.verbose)
+        else:
+            sys.stderr.write(f'Submission of {r["jobfile"]} failed: {r["error"]}\n')
+
+    if len(records) > 1:
+        print(f'Submitted {len(records) - len(failed)} of {len(records)} jobs')
+    if failed:
+        sys.exit(1)
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(importlib.import_module(COMMANDS[sys.argv[1]]).main(sys.argv[2:]))
+
     # Initialize argument parser
     parser = cli()
     args = parser.parse_args()
+    args.incremental = args.incremental or args.dry_run
+
+    # Submit existing job files only
+    if args.submit:
+        submit(args.submit, args)
+        sys.exit()
+
+    # Everything else is imported once it is known to be needed, keeping --help and --submit fast
+    from config import config_from_args, timelimit_from_args
+    from environment import EnvironmentSchemaError, get_environments
 
     testing = True if any([args.test_gaussian, args.test_orca, args.test_mrchem]) else False
 
     # Manually convert convenience timelimit units to slurm format
-    if args.stime is not None:
-        timelimit = args.stime
-    else:
-        timelimit = f'{args.days}-{args.hours}:{args.minutes}:{args.seconds}'
-        if timelimit == '00-00:00:00':
-            debug('Warning: Walltime set to zero', not testing)
+    timelimit = timelimit_from_args(args)
+    if args.stime is None and timelimit == '00-00:00:00':
+        debug('Warning: Walltime set to zero', not testing and not args.auto_resources)
+
+    # Load and validate the environments once, before any job needs them
+    try:
+        get_environments()
+    except EnvironmentSchemaError as e:
+        sys.exit(str(e))
 
     # Initialize the slurm configuration
-    config = Config(loc=args.loc,
-                    hybrid=args.hybrid,
-                    input=args.input,
-                    account=args.account,
-                    timelimit=timelimit,
-                    memory=args.memory,
-                    memtype=args.memtype,
-                    nodes=args.nodes,
-                    ntasks=args.ntasks,
-                    cpus=args.cpus,
-                    mail=args.mail,
-                    partition=args.partition,
-                    cluster=args.cluster,
-                    dev=args.devel,
-                    exclusive=args.exclusive,
-                    display_name=args.display_name)
+    config = config_from_args(args, timelimit)
+
+    # Pick the cluster and partition with the shortest expected wait
+    if args.placement:
+        from placement import PlacementError, place_from_args
+        try:
+            explanation = place_from_args(config, args)
+        except PlacementError as e:
+            sys.exit(str(e))
+        print(explanation if args.verbose else explanation.split('\n')[-1])
+
+    # Fit the resource model once for all inputs
+    model = None
+    if args.auto_resources:
+        if args.history is None:
+            sys.exit('--auto-resources needs a job history (--history).')
+        from autotune import ResourceModel
+        model = ResourceModel.from_history(args.history, args.history_inputs, config.ext_inp)
+        debug(f'Resource model fitted for: {", ".join(sorted(model.time)) or "no code"}', args.verbose)
 
     # Check if testing was requested. Exit program if any test requested.
+    if testing:
+        from jobs import MRChemJob, GaussianJob, ORCAJob
     if args.test_gaussian:
         job = GaussianJob(config=config)
         job.make_test_files()
@@ -65,54 +153,152 @@ if __name__ == '__main__':
     if testing:
         sys.exit()
 
+    from batch import BatchSummary, expand_inputs, is_batch, make_job, run_batch
+    from detect import CodeCache, UnknownJonError
+    from layout import LayoutError
+    from sweep import is_sweep
+    from templates import TemplateError
+
+    if is_sweep(args):
+        from detect import detect_code
+        from sweep import SweepError, make_sweep, point_record, write_index
+        if is_batch(args):
+            sys.exit('Sweeps take a single input file.')
+        # The points only differ for ORCA and Gaussian if their inputs follow the request (implies --sync-input)
+        if args.sync_input == 'check':
+            sys.exit('Sweeps adjust the input of every point, --sync-input check is not supported.')
+        args.sync_input = 'set'
+
+        code = detect_code(config.input + config.ext_inp) or args.code
+        records, jobfiles = [], []
+        try:
+            for name, job, reason in make_sweep(config, args, code):
+                if job is None:
+                    debug(f'{name}: pruned ({reason})', args.verbose)
+                    continue
+                if args.sync_input:
+                    from inputsync import sync_job
+                    changes = sync_job(job, args.sync_input)
+                    if changes is not None:
+                        print(f'{name}: {changes}')
+                if args.incremental:
+                    changed = write_incremental(job, args)
+                else:
+                    write_job(job, args)
+                    changed = True
+                records.append(point_record(name, job))
+                if changed:
+                    jobfiles.append(job.jobfile)
+        except (SweepError, UnknownJonError, TemplateError, LayoutError) as e:
+            sys.exit(str(e))
+        if not records:
+            sys.exit('No points left in the sweep.')
+
+        if not args.dry_run:
+            index = write_index(config, code, records, args)
+            debug(f'{len(records)} points of the sweep recorded in {index}', args.verbose)
+        if args.execute and jobfiles:
+            submit(jobfiles, args)
+        sys.exit()
+
+    if is_batch(args):
+        inputs = expand_inputs(args.input, args.from_list)
+        if not inputs:
+            sys.exit('No input files found.')
+
+        cache = CodeCache() if not args.no_code_cache else None
+        if args.array or args.farm:
+            if args.requeue_on_timeout:
+                sys.exit('--requeue-on-timeout is not supported for job arrays and farms.')
+            if args.incremental:
+                sys.exit('--incremental and --dry-run are not supported for job arrays and farms.')
+            from jobarray import MixedArrayError, make_array
+            from farm import FarmError, make_farm
+            try:
+                if args.array:
+                    job = make_array(inputs, config, args, name=args.id or 'array', limit=args.array_limit, cache=cache)
+                    debug(f'{CODE_NAMES.get(job.code, "Unknown code")} job array with {len(inputs)} tasks', args.verbose)
+                else:
+                    job = make_farm(inputs, config, args, name=args.id or 'farm', slots=args.farm_slots,
+                                    step=args.farm_step, cache=cache)
+                    debug(f'Farm of {len(inputs)} calculations ({job.code}) in {args.farm_slots} slots', args.verbose)
+            except (MixedArrayError, FarmError, UnknownJonError, TemplateError, LayoutError) as e:
+                sys.exit(str(e))
+            finally:
+                if cache is not None:
+                    cache.save()
+
+            for path, changes in job.reports:
+                print(f'{path}: {changes}')
+            write_job(job, args)
+            if args.execute:
+                submit([job.jobfile], args)
+            sys.exit()
+
+        summary = BatchSummary()
+        written, unchanged = [], []
+        for path, (jobfile, code, status, error, _, changes, digest) in run_batch(inputs, config, args, jobs=args.jobs, cache=cache, model=model):
+            summary.add(path, code, status, error)
+            if changes is not None:
+                print(f'{path}: {changes}')
+            if status == 'failed':
+                debug(f'{path}: failed ({error})', args.verbose)
+            else:
+                debug(f'{path}: {CODE_NAMES.get(code, "unknown code")}, {jobfile} {status}', args.verbose)
+            if args.incremental:
+                from manifest import manifest_for
+                manifest = manifest_for(jobfile) if jobfile is not None else None
+                if status == 'written':
+                    manifest.record(jobfile, digest)
+                elif status == 'edited' or (args.dry_run and status in ['new', 'changed']):
+                    print(f'{jobfile}: {manifest.describe(jobfile, digest, status)}')
+            if status == 'written':
+                written.append(jobfile)
+            elif status == 'unchanged':
+                unchanged.append(jobfile)
+
+        if cache is not None:
+            cache.save()
+        if args.incremental:
+            from manifest import manifest_for, save_manifests
+            save_manifests()
+            # Jobs are submitted when they changed since their last submission
+            written = [f for f in written + unchanged if manifest_for(f).needs_submit(f)]
+
+        print(summary)
+        if args.execute and written and not args.dry_run:
+            submit(written, args)
+        sys.exit()
+
     # Read input and determine the code
     # Then construct the job classes
-    g, o, m = resolve_code(config.input + config.ext_inp)
-    if g == o == m == False:
-        if args.code == 'orca': o = True
-        if args.code == 'gaussian': g = True
-        if args.code == 'mrchem': m = True
-    if g:
-        debug(f'Gaussian input detected', args.verbose)
-        job = GaussianJob(config=config,
-                          need_files=args.copy_to,
-                          save_files=args.copy_back)
-    elif o:
-        debug(f'ORCA input detected', args.verbose)
-        job = ORCAJob(config=config,
-                      need_files=args.copy_to,
-                      save_files=args.copy_back)
-    elif m:
-        debug(f'MRChem input detected', args.verbose)
-        job = MRChemJob(config=config,
-                        store_orbs=not args.rm_orb,
-                        store_chk=not args.rm_check,
-                        init_orbs=args.guess_orb,
-                        init_check=args.guess_check,
-                        need_files=args.copy_to,
-                        save_files=args.copy_back,
-                        json=args.json,
-                        version=args.version)
+    try:
+        if model is not None:
+            from autotune import autotune
+            tuned = autotune(config, config.input + config.ext_inp, model)
+            debug(f'Resources predicted from {tuned}' if tuned else 'No resource prediction for this input', args.verbose)
+        job = make_job(config, args)
+    except (UnknownJonError, TemplateError, LayoutError) as e:
+        sys.exit(str(e))
+    if config.layout is not None:
+        debug(f'Layout: {config.layout}', args.verbose)
+    if args.sync_input:
+        from inputsync import sync_job
+        changes = sync_job(job, args.sync_input)
+        if changes is not None:
+            print(f'{config.input + config.ext_inp}: {changes}')
+    if job.code is not None:
+        debug(f'{CODE_NAMES[job.code]} input detected', args.verbose)
     else:
         debug('Code not determined', args.verbose)
-        job = Job(config=config)
 
     # Write job files
-    if os.path.exists(job.jobfile):
-        if args.force:
-            job.write()
-            debug(f'File written to {job.jobfile}', args.verbose)
-        else:
-            if input(f'Job file <{job.jobfile}> exists. Overwrite? ([y]/n) ') in AFFIRMATIVE:
-                job.write()
-                debug(f'File written to {job.jobfile}', args.verbose)
-            else:
-                sys.exit('Aborted')
+    if args.incremental:
+        changed = write_incremental(job, args)
     else:
-        job.write()
-        debug(f'File written to {job.jobfile}', args.verbose)
+        write_job(job, args)
+        changed = True
 
-    if args.execute:
-        debug('Submitting to queue...', args.verbose)
-        subprocess.call(['sbatch', job.jobfile])
+    if args.execute and changed:
+        submit([job.jobfile], args)
 
@@ -0,0 +1,112 @@
+import argparse
+import json
+import math
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from autotune import parse_memory
+from instrument import PHASES
+
+
+def find_timing(paths):
+    """Yield the .timing files given, or found below the given directories."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        stack = [path]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for e in entries:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.name.endswith('.timing'):
+                        yield e.path
+
+
+def read_timing(path):
+    """Phase durations of every run recorded in a timing file. Returns a list of
+    (code, cluster, phase, seconds) and a list of (code, cluster, peak MaxRSS in GB)."""
+    runs = defaultdict(dict)
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    m = json.loads(line)
+                except ValueError:
+                    continue
+                run = runs[(m['job'], m['stem'])]
+                run.setdefault('key', (m['code'], m['cluster']))
+                run[(m['phase'], m['event'])] = m['time']
+                rss = parse_memory(m['maxrss']) if m.get('maxrss') else None
+                if rss is not None:
+                    run['maxrss'] = max(run.get('maxrss', 0.0), rss)
+    except OSError:
+        return [], []
+
+    durations, memory = [], []
+    for run in runs.values():
+        code, cluster = run['key']
+        starts = [run[(p, 'start')] for p in PHASES if (p, 'start') in run]
+        ends = [run[(p, 'end')] for p in PHASES if (p, 'end') in run]
+        for phase in PHASES:
+            if (phase, 'start') in run and (phase, 'end') in run:
+                durations.append((code, cluster, phase, run[(phase, 'end')] - run[(phase, 'start')]))
+        if starts and ends:
+            durations.append((code, cluster, 'total', max(ends) - min(starts)))
+        if 'maxrss' in run:
+            memory.append((code, cluster, run['maxrss']))
+    return durations, memory
+
+
+def percentile(values, p):
+    """Nearest rank percentile of sorted values."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def aggregate(files, workers=8):
+    """Collect durations per (code, cluster, phase) and peak memory per (code, cluster),
+    reading the files concurrently."""
+    durations, memory = defaultdict(list), defaultdict(list)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for d, m in pool.map(read_timing, files):
+            for code, cluster, phase, seconds in d:
+                durations[(code, cluster, phase)].append(seconds)
+            for code, cluster, gb in m:
+                memory[(code, cluster)].append(gb)
+    return durations, memory
+
+
+def format_table(durations, memory, percentiles):
+    order = {p: i for i, p in enumerate(PHASES + ['total'])}
+    header = f'{"code":<10}{"cluster":<8}{"phase":<11}{"n":>7}' + ''.join(f'{"p" + str(p):>10}' for p in percentiles)
+    lines = [header]
+    for key in sorted(durations, key=lambda k: (k[0], k[1], order[k[2]])):
+        values = sorted(durations[key])
+        lines.append(f'{key[0]:<10}{key[1]:<8}{key[2]:<11}{len(values):>7}' +
+                     ''.join(f'{percentile(values, p):>9.1f}s' for p in percentiles))
+    if memory:
+        lines.append('')
+        lines.append(f'{"code":<10}{"cluster":<8}{"MaxRSS":<11}{"n":>7}' + ''.join(f'{"p" + str(p):>10}' for p in percentiles))
+        for key in sorted(memory):
+            values = sorted(memory[key])
+            lines.append(f'{key[0]:<10}{key[1]:<8}{"":<11}{len(values):>7}' +
+                         ''.join(f'{percentile(values, p):>8.2f}GB' for p in percentiles))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pyslurm.py report', description='Per phase timing percentiles of instrumented jobs (--instrument).')
+    parser.add_argument('paths', nargs='*', default=['.'], help='.timing files or directories to search (default: .)')
+    parser.add_argument('-p', '--percentiles', default='50,90,99', help='Comma separated percentiles (default: 50,90,99).')
+    parser.add_argument('-j', '--jobs', default=8, type=int, metavar='N', help='Number of files read concurrently.')
+    args = parser.parse_args(argv)
+
+    percentiles = [float(p) if '.' in p else int(p) for p in args.percentiles.split(',')]
+    durations, memory = aggregate(find_timing(args.paths), workers=args.jobs)
+    if not durations:
+        print('No timing records found.')
+        return 1
+    print(format_table(durations, memory, percentiles))
+    return 0
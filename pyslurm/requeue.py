@@ -0,0 +1,110 @@
+import re
+
+# Directory in the job directory the inputs of continuation jobs are written to (with unchanged file names)
+RESTART = 'restart'
+
+# Shell functions emitted into jobs with --requeue-on-timeout. SLURM sends USR1 to the batch shell
+# (--signal=B:USR1@<lead>) ahead of the time limit. The calculation runs in the background so that
+# the trap runs as soon as the signal arrives: it stops the calculation, saves what the normal
+# stage-out would, and submits the continuation job with the restart count increased. Jobs waiting
+# for this one (afterok) are pointed at the continuation.
+FUNCTIONS = r'''PYSLURM_RESTART=${PYSLURM_RESTART:-0}
+pyslurm_resubmit() {
+    if [ $PYSLURM_RESTART -ge @MAX@ ]; then
+        echo "pyslurm: no restarts left (@MAX@)" >&2
+        return 1
+    fi
+    local id=$(cd ${SLURM_SUBMIT_DIR} && sbatch --parsable --export=ALL,PYSLURM_RESTART=$((PYSLURM_RESTART + 1)) @CONTINUATION@)
+    id=${id%%;*}
+    if [ -z "$id" ]; then
+        echo "pyslurm: resubmission failed" >&2
+        return 1
+    fi
+    echo "pyslurm: continued in job $id (restart $((PYSLURM_RESTART + 1)) of @MAX@)"
+    squeue --me -h -t PENDING -o '%i %E' | grep -E ":${SLURM_JOB_ID}([:,(]|$)" | while read dep deps; do
+        scontrol update JobId=$dep Dependency=$(echo $deps | sed -E -e 's/\([a-z]*\)//g' -e "s/:${SLURM_JOB_ID}([:,]|$)/:$id\1/g")
+    done
+}'''
+
+TRAP = r'''pyslurm_timeout() {
+    echo "pyslurm: time limit in @LEAD@ s, saving"
+    pkill -TERM -P $PYSLURM_PID
+    for i in $(seq 60); do kill -0 $PYSLURM_PID 2>/dev/null || break; sleep 1; done
+@SAVE@
+    @RESUBMIT@
+    exit $?
+}
+trap pyslurm_timeout USR1'''
+
+MOREAD = re.compile(r'\bMOREAD\b', re.IGNORECASE)
+SCF_BLOCK = re.compile(r'\s*SCF\s*\{', re.IGNORECASE)
+
+
+def continuation_name(job):
+    return f'{job.stem}_restart{job.ext}'
+
+
+def restart_gbw(job):
+    """Copy of the ORCA orbitals saved on timeout, read by the continuation. ORCA does not read
+    its orbitals from the .gbw file it writes to."""
+    return f'{job.stem}_restart.gbw'
+
+
+def add_trap(fields, job):
+    """Run the calculation in the background, with the timeout trap defined ahead of the prologue.
+    Codes without a restart only save on timeout."""
+    lead = job.config.signal.split('@')[-1] if job.config.signal is not None else '?'
+    save = job.build_stage_out()
+    if job.code == 'orca':
+        save.append(f'cp {job.stem}.gbw ${{SLURM_SUBMIT_DIR}}/{restart_gbw(job)}')
+    trap = (TRAP.replace('@LEAD@', str(lead))
+            .replace('@SAVE@', '\n'.join('    ' + line if line else '' for line in save))
+            .replace('@RESUBMIT@', 'pyslurm_resubmit' if job.restartable else 'false'))
+    functions = FUNCTIONS.replace('@MAX@', str(job.requeue)).replace('@CONTINUATION@', continuation_name(job))
+
+    fields['run'] = f'{{\n{fields["run"]}\n}} &\nPYSLURM_PID=$!\nwait $PYSLURM_PID'
+    fields['prologue'] = (functions + '\n' if job.restartable else '') + trap + '\n\n' + fields['prologue']
+    return fields
+
+
+def restart_orca(text, gbw):
+    """Read the starting orbitals from gbw (! MOREAD, %moinp), replacing any %moinp of the input."""
+    lines = text.split('\n')
+    has_moread = any(line.strip().startswith('!') and MOREAD.search(line) for line in lines)
+    has_moinp = False
+    for i, line in enumerate(lines):
+        if line.strip().lower().startswith('%moinp'):
+            lines[i] = f'%moinp "{gbw}"'
+            has_moinp = True
+
+    missing = ([] if has_moread else ['! MOREAD']) + ([] if has_moinp else [f'%moinp "{gbw}"'])
+    keywords = [i for i, line in enumerate(lines) if line.strip().startswith('!')]
+    at = keywords[-1] + 1 if keywords else 0
+    return '\n'.join(lines[:at] + missing + lines[at:])
+
+
+def restart_mrchem(text):
+    """Start from the checkpoint (SCF guess_type = chk), and keep writing checkpoints."""
+    settings = {'guess_type': 'chk', 'write_checkpoint': 'true'}
+    lines = text.split('\n')
+    start = next((i for i, line in enumerate(lines) if SCF_BLOCK.match(line)), None)
+    if start is None:
+        at = len(lines) - 1 if lines[-1] == '' else len(lines)
+        return '\n'.join(lines[:at] + ['SCF {'] + [f'  {k} = {v}' for k, v in settings.items()] + ['}'] + lines[at:])
+
+    end = start + 1
+    while end < len(lines) and '}' not in lines[end]:
+        key = lines[end].split('=')[0].strip().lower()
+        if key in settings:
+            lines[end] = f'  {key} = {settings.pop(key)}'
+        end += 1
+    return '\n'.join(lines[:start + 1] + [f'  {k} = {v}' for k, v in settings.items()] + lines[start + 1:])
+
+
+def restart_input(job, text):
+    """The input of the continuation of job, restarting from the state saved on timeout."""
+    if job.code == 'orca':
+        return restart_orca(text, restart_gbw(job))
+    if job.code == 'mrchem' and not job.json:
+        return restart_mrchem(text)
+    return text
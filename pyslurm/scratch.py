@@ -0,0 +1,123 @@
+import re
+
+from environment import SCRATCH as POLICIES
+from inputsync import gaussian_mb
+from layout import LayoutError, get_clusters, memory_gb
+
+# Expected disk footprint (GB) from which auto picks node-local scratch
+AUTO_THRESHOLD = 20
+
+# Footprint assumed for correlated (post-HF) calculations, unless given with --disk or MaxDisk
+POST_HF_DISK = 100
+
+# Node-local scratch requested when neither the footprint nor a size is known
+DEFAULT_SIZE = 50
+
+# Share of the node-local scratch request Gaussian may fill (MaxDisk), the rest is left for other files
+GAUSSIAN_DISK_HEADROOM = 0.9
+
+POST_HF = re.compile(r'\b(RI-)?(MP[2-5]|DLPNO|CCSD|CISD|QCISD|CASSCF|CASPT2|NEVPT2|CIS|EOM|MRCI|MRCC)', re.IGNORECASE)
+MAXDISK = re.compile(r'MaxDisk\s*=\s*([0-9.]+\s*[KMGT]?[BW]?)', re.IGNORECASE)
+
+
+class ScratchError(LayoutError):
+    pass
+
+
+def disk_gb(s):
+    """GB from a size such as 200GB or 200G, plain numbers are GB."""
+    s = str(s).strip()
+    return float(s) if re.match(r'[0-9.]+$', s) else memory_gb(s if s.upper().endswith('B') else s + 'B')
+
+
+def keywords(path, code):
+    """Method and option lines of an input: ! lines for ORCA, the route section for Gaussian."""
+    try:
+        with open(path, errors='replace') as f:
+            lines = f.read().split('\n')
+    except OSError:
+        return ''
+    if code == 'orca':
+        return ' '.join(line for line in lines if line.strip().startswith('!'))
+    if code == 'gaussian':
+        return ' '.join(line for line in lines if line.strip().startswith('#'))
+    return ''
+
+
+def expected_disk(path, code, disk=None):
+    """Expected disk footprint (GB) of a calculation: the given size, MaxDisk of a Gaussian input,
+    or a rough guess for correlated methods. Other calculations are taken to need little disk."""
+    if disk is not None:
+        return disk_gb(disk)
+    words = keywords(path, code)
+    m = MAXDISK.search(words)
+    if m and gaussian_mb(m.group(1)) is not None:
+        return gaussian_mb(m.group(1)) / 1024
+    if POST_HF.search(words):
+        return POST_HF_DISK
+    return 0
+
+
+def local_capacity(cluster):
+    """Node-local scratch per node (GB), or None if jobs cannot request it on cluster."""
+    node = get_clusters().get(cluster, {})
+    return disk_gb(node['localscratch']) if 'localscratch' in node else None
+
+
+def plan_scratch(config, code, path, policy='shared', size=None, disk=None):
+    """Decide between the shared $SCRATCH and node-local $LOCALSCRATCH for a calculation, and request
+    the node-local space (--gres=localscratch:<size>) in config. auto picks node-local scratch for
+    an expected footprint of AUTO_THRESHOLD GB or more, where the cluster has it.
+    Returns the size of the node-local request (GB), or None for the shared scratch."""
+    if policy not in POLICIES:
+        raise ScratchError(f'Unknown scratch policy: {policy} (one of {", ".join(POLICIES)})')
+    if policy == 'shared':
+        return None
+
+    capacity = local_capacity(config.cluster)
+    expected = expected_disk(path, code, disk)
+    if policy == 'auto' and (capacity is None or expected < AUTO_THRESHOLD):
+        return None
+    if capacity is None:
+        raise ScratchError(f'{config.cluster} jobs cannot request node-local scratch')
+
+    gb = disk_gb(size) if size is not None else max(expected, DEFAULT_SIZE)
+    if gb > capacity:
+        if policy == 'auto':
+            return None
+        raise ScratchError(f'{gb:g}GB of node-local scratch requested, but {config.cluster} nodes have {capacity:g}GB')
+    gb = int(-(-gb // 1))
+    config.gres = f'localscratch:{gb}G'
+    config.build_config()
+    return gb
+
+
+def gaussian_step(lines, stem, maxdisk):
+    lines = [line for line in lines if not line.strip().lower().startswith('%rwf')]
+    link0 = next((i for i, line in enumerate(lines) if not line.strip().startswith('%')), len(lines))
+    lines.insert(link0, f'%RWF={stem}.rwf')
+
+    start = next((i for i, line in enumerate(lines) if line.strip().startswith('#')), None)
+    if start is None:
+        return lines
+    end = next((i for i in range(start, len(lines)) if not lines[i].strip()), len(lines))
+    if any(MAXDISK.search(lines[i]) for i in range(start, end)):
+        for i in range(start, end):
+            lines[i] = MAXDISK.sub(f'MaxDisk={maxdisk}GB', lines[i])
+    else:
+        lines[start] = f'{lines[start].rstrip()} MaxDisk={maxdisk}GB'
+    return lines
+
+
+def gaussian_disk(text, stem, maxdisk):
+    """Keep the read-write file in the working directory (%RWF) and limit the disk use (MaxDisk, GB)
+    in every job step (--Link1--) of a Gaussian input. Existing settings are replaced."""
+    steps, current = [], []
+    for line in text.split('\n'):
+        if line.strip().lower() == '--link1--':
+            steps.append(current)
+            current = []
+        else:
+            current.append(line)
+    steps.append(current)
+    return '\n--Link1--\n'.join('\n'.join(gaussian_step(step, stem, maxdisk)) for step in steps)
@@ -0,0 +1,108 @@
+import os
+
+# Shell functions emitted into job scripts using parallel staging. Copies are skipped if the
+# destination has the same size and mtime (cp -p keeps the mtime). On multi-node jobs,
+# broadcast files are sent to node-local storage with sbcast and linked into $SCRATCH, so
+# every node reads its own copy.
+FUNCTIONS = r'''PYSLURM_PIDS=()
+PYSLURM_NODE_DIR=${LOCALSCRATCH:-/tmp}/pyslurm_${SLURM_JOB_ID}
+
+pyslurm_elapsed() {
+    awk -v t0=$1 -v t1=$(date +%s.%N) 'BEGIN {printf "%.1f", t1 - t0}'
+}
+
+pyslurm_copy() {
+    local dst=$2
+    [ -d "$dst" ] && dst=$dst/$(basename "$1")
+    if [ -e "$dst" ] && [ "$(stat -c '%s %Y' "$1")" = "$(stat -c '%s %Y' "$dst")" ]; then
+        return 0
+    fi
+    cp -p "$1" "$dst"
+}
+export -f pyslurm_copy
+
+pyslurm_copy_dir() {
+    mkdir -p "$2"
+    (cd "$1" && find . -type d -print0) | (cd "$2" && xargs -0 mkdir -p)
+    (cd "$1" && find . -type f -print0) | xargs -0 -P @WORKERS@ -I{} bash -c 'pyslurm_copy "$1/$3" "$2/$3"' _ "$1" "$2" {}
+}
+
+pyslurm_multinode() {
+    [ "${SLURM_JOB_NUM_NODES:-1}" -gt 1 ]
+}
+
+pyslurm_bcast() {
+    if ! pyslurm_multinode; then
+        pyslurm_copy "$1" "$2"
+        return
+    fi
+    srun --nodes=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 mkdir -p $PYSLURM_NODE_DIR
+    sbcast -f "$1" $PYSLURM_NODE_DIR/$(basename "$1") && ln -sf $PYSLURM_NODE_DIR/$(basename "$1") "$2"
+}
+
+pyslurm_bcast_dir() {
+    if ! pyslurm_multinode; then
+        pyslurm_copy_dir "$1" "$2"
+        return
+    fi
+    local dir=$PYSLURM_NODE_DIR/$(basename "$2")
+    srun --nodes=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 mkdir -p $dir
+    find "$1" -maxdepth 1 -type f -print0 | xargs -0 -P @WORKERS@ -I{} sh -c 'sbcast -f "$1" "$2/$(basename "$1")"' _ {} $dir
+    ln -sfn $dir "$2"
+}
+
+pyslurm_wait() {
+    local rc=0
+    for pid in "${PYSLURM_PIDS[@]}"; do
+        wait $pid || rc=1
+    done
+    PYSLURM_PIDS=()
+    return $rc
+}'''
+
+
+class Staging:
+    """Parallel stage-in and stage-out for the generated scripts."""
+    def __init__(self, workers=8, bcast=None, bcast_guess=False):
+        self.workers = workers
+        self.bcast = list(bcast) if bcast is not None else []
+        self.bcast_guess = bcast_guess
+
+    @staticmethod
+    def background(line):
+        return f'{line} & PYSLURM_PIDS+=($!)'
+
+    def stage_in(self, inputpath, need_files, scratch, guesses=None):
+        """Copy input and needed files to scratch and the guess directories (source, name) into it,
+        all concurrently. The script is in scratch afterwards."""
+        job = FUNCTIONS.replace('@WORKERS@', str(self.workers)).split('\n')
+        job.append('')
+        job.append('PYSLURM_T0=$(date +%s.%N)')
+        if scratch != '$SCRATCH':
+            job.append(f'mkdir -p {scratch}')
+        job.append(self.background(f'pyslurm_copy {inputpath} {scratch}'))
+        for f in need_files + [f for f in self.bcast if f not in need_files]:
+            if f in self.bcast:
+                job.append(self.background(f'pyslurm_bcast {f} {scratch}/{os.path.basename(f)}'))
+            else:
+                job.append(self.background(f'pyslurm_copy {f} {scratch}'))
+
+        job.append(f'cd {scratch}')
+        for src, name in guesses or []:
+            copy = 'pyslurm_bcast_dir' if self.bcast_guess and name == 'initial_guess' else 'pyslurm_copy_dir'
+            job.append(self.background(f'{copy} {src} {name}'))
+
+        job.append('pyslurm_wait || echo "pyslurm: stage-in failed" >&2')
+        job.append('echo "pyslurm: stage-in took $(pyslurm_elapsed $PYSLURM_T0) s"')
+        return job
+
+    def copy_dir(self, src, dst):
+        return self.background(f'pyslurm_copy_dir {src} {dst}')
+
+    def stage_out_start(self):
+        return ['PYSLURM_T0=$(date +%s.%N)']
+
+    def stage_out_end(self):
+        return ['',
+                'pyslurm_wait || echo "pyslurm: stage-out failed" >&2',
+                'echo "pyslurm: stage-out took $(pyslurm_elapsed $PYSLURM_T0) s"']
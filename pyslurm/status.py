@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import write_atomic
+from outputs import SECONDS, final_energy, identify, read_head, read_tail
+
+STATES = ['converged', 'failed', 'timeout', 'requeued', 'running', 'queued', 'unfinished', 'not started']
+
+# Last lines of the output of a calculation that ended, per code
+NORMAL = {'orca': 'ORCA TERMINATED NORMALLY', 'gaussian': 'Normal termination of Gaussian'}
+ABNORMAL = {'orca': re.compile(r'ORCA finished by error termination|aborting the run'),
+            'gaussian': re.compile(r'Error termination')}
+
+# Error classes, by the messages in the end of the output or in the SLURM log and error files
+ERRORS = [('time limit', re.compile(r'DUE TO TIME LIMIT')),
+          ('memory', re.compile(r'oom[-_ ]kill|Out Of Memory|could not allocate memory|not enough memory', re.IGNORECASE)),
+          ('disk', re.compile(r'No space left on device|Disk quota exceeded', re.IGNORECASE)),
+          ('scf convergence', re.compile(r'SCF NOT CONVERGED|Convergence failure|l502\.exe')),
+          ('geometry convergence', re.compile(r'OPTIMIZATION DID NOT CONVERGE|Optimization stopped|l103\.exe')),
+          ('input', re.compile(r'INPUT ERROR|UNRECOGNIZED|Unknown keyword|QPErr|l1\.exe')),
+          ('cancelled', re.compile(r'CANCELLED AT')),
+          ('mpi', re.compile(r'MPI_ABORT|mpirun noticed|ORTE was unable'))]
+
+# Written to the log by jobs continued with --requeue-on-timeout
+REQUEUED = 'pyslurm: continued in job'
+
+# Bytes read from the end of the SLURM log and error files
+LOG_TAIL = 16 * 1024
+
+
+def default_cache_path():
+    cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache, 'pyslurm', 'status.json')
+
+
+def find_calculations(paths, ext_out='.out'):
+    """Group the job, output, log and error files (and MRChem .json) below the given directories by
+    calculation. Returns {path without extension: {extension: stat stamp}}. Continuation jobs
+    (<stem>_restart.job) share the files of their calculation."""
+    extensions = {'.job', ext_out, '.log', '.err', '.json'}
+    calculations = defaultdict(dict)
+    stack = list(paths)
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for e in entries:
+                if e.name.startswith('.'):
+                    continue
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                    continue
+                stem, ext = os.path.splitext(e.path)
+                if ext in extensions:
+                    st = e.stat()
+                    calculations[stem][ext] = [st.st_mtime_ns, st.st_size]
+
+    for stem in list(calculations):
+        files = calculations[stem]
+        if set(files) <= {'.json'} or (stem.endswith('_restart') and stem[:-len('_restart')] in calculations):
+            del calculations[stem]
+    return calculations
+
+
+def error_class(text):
+    for name, pattern in ERRORS:
+        if pattern.search(text):
+            return name
+    return None
+
+
+def read_mrchem_json(path):
+    """Success and total energy from the final MRChem JSON output, or (None, None)."""
+    try:
+        with open(path) as f:
+            output = json.load(f).get('output', {})
+    except (OSError, ValueError, AttributeError):
+        return None, None
+    energy = output.get('properties', {}).get('scf_energy', {}).get('E_tot')
+    return output.get('success'), energy
+
+
+def scan(stem, files, ext_out='.out'):
+    """State, code, final energy, wall time and error class of a calculation. Only the start and the
+    end of the output are read, and the end of the log and error files."""
+    result = {'code': None, 'state': 'not started', 'energy': None, 'wall': None, 'error': None}
+    slurm = ''
+    for ext in ['.log', '.err']:
+        if ext in files:
+            try:
+                slurm += read_tail(stem + ext, LOG_TAIL)
+            except OSError:
+                pass
+    tail = ''
+    if ext_out in files:
+        try:
+            result['code'] = identify(read_head(stem + ext_out))
+            tail = read_tail(stem + ext_out)
+        except OSError:
+            pass
+    code = result['code']
+
+    success = None
+    if code == 'mrchem' and '.json' in files:
+        success, result['energy'] = read_mrchem_json(stem + '.json')
+    if code in NORMAL:
+        normal, abnormal = tail.rfind(NORMAL[code]), max([m.start() for m in ABNORMAL[code].finditer(tail)], default=-1)
+        success = True if normal > abnormal else (False if abnormal > normal else None)
+
+    if success:
+        result['state'] = 'converged'
+    elif success is False:
+        result['state'] = 'failed'
+    elif REQUEUED in slurm:
+        result['state'] = 'requeued'
+    elif 'DUE TO TIME LIMIT' in slurm:
+        result['state'] = 'timeout'
+    elif error_class(slurm) is not None:
+        result['state'] = 'failed'
+    elif tail or slurm:
+        result['state'] = 'unfinished'
+
+    if result['state'] in ['failed', 'timeout']:
+        result['error'] = error_class(slurm + tail) or 'error'
+    if code is not None:
+        if result['energy'] is None:
+            result['energy'] = final_energy(code, tail)
+        result['wall'] = SECONDS[code](tail)
+    return result
+
+
+class StatusCache:
+    """Scan results by calculation, invalidated when any of its files changes (mtime and size)."""
+    def __init__(self, path=None):
+        self.path = path if path is not None else default_cache_path()
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def stamp(files):
+        return sorted([ext] + stat for ext, stat in files.items() if ext != '.job')
+
+    def get(self, stem, files):
+        entry = self.entries.get(os.path.abspath(stem))
+        if entry is not None and entry['stamp'] == self.stamp(files):
+            return entry['result']
+        return None
+
+    def put(self, stem, files, result):
+        self.entries[os.path.abspath(stem)] = {'stamp': self.stamp(files), 'result': result}
+        self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            write_atomic(self.path, json.dumps(self.entries))
+            self.dirty = False
+
+
+def scan_all(calculations, ext_out='.out', workers=16, cache=None):
+    """Scan all calculations, the ones not in the cache concurrently. Returns {stem: result}."""
+    results, todo = {}, []
+    for stem, files in calculations.items():
+        result = cache.get(stem, files) if cache is not None else None
+        if result is not None:
+            results[stem] = result
+        else:
+            todo.append(stem)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stem, result in zip(todo, pool.map(lambda s: scan(s, calculations[s], ext_out), todo)):
+            results[stem] = result
+            if cache is not None:
+                cache.put(stem, calculations[stem], result)
+    return results
+
+
+def queue_states(squeue=None):
+    """SLURM state of your queued and running jobs by job name, or {} if squeue is not available."""
+    cmd = shlex.split(squeue if squeue is not None else os.environ.get('PYSLURM_SQUEUE_STATES', "squeue --me -h -o '%j %T'"))
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True)
+    except OSError:
+        return {}
+    states = {}
+    for line in p.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            states[parts[0]] = 'running' if parts[1] in ['RUNNING', 'COMPLETING'] else 'queued'
+    return states
+
+
+def hms(seconds):
+    m, s = divmod(int(round(seconds)), 60)
+    h, m = divmod(m, 60)
+    return f'{h}:{m:02d}:{s:02d}'
+
+
+def format_table(results):
+    width = max([len(os.path.relpath(s)) for s in results] + [4]) + 2
+    lines = [f'{"path":<{width}}{"code":<10}{"state":<13}{"energy":>18}{"wall":>11}  error']
+    for stem in sorted(results):
+        r = results[stem]
+        energy = f'{r["energy"]:.8f}' if r['energy'] is not None else '-'
+        wall = hms(r['wall']) if r['wall'] is not None else '-'
+        lines.append(f'{os.path.relpath(stem):<{width}}{r["code"] or "-":<10}{r["state"]:<13}{energy:>18}{wall:>11}  {r["error"] or ""}'.rstrip())
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pyslurm.py status', description='State, final energy, wall time and error class of the calculations below the given directories.')
+    parser.add_argument('paths', nargs='*', default=['.'], help='Campaign directories (default: .)')
+    parser.add_argument('-s', '--state', type=str, help=f'Only list calculations in these comma separated states ({", ".join(STATES)}).')
+    parser.add_argument('-j', '--jobs', default=16, type=int, metavar='N', help='Number of calculations scanned concurrently.')
+    parser.add_argument('--ext-out', default='.out', type=str, help='Extension of the output files (default: .out).')
+    parser.add_argument('--summary', action='store_true', help='Only print the number of calculations per state.')
+    parser.add_argument('--queue', action='store_true', help='Mark calculations queued or running in SLURM (by job name, from squeue).')
+    parser.add_argument('--squeue', type=str, help="Command listing job name and state of your jobs (default: $PYSLURM_SQUEUE_STATES or squeue --me -h -o '%%j %%T').")
+    parser.add_argument('--no-cache', action='store_true', help='Do not use the cache of scan results.')
+    args = parser.parse_args(argv)
+
+    calculations = find_calculations(args.paths, args.ext_out)
+    cache = StatusCache() if not args.no_cache else None
+    results = scan_all(calculations, args.ext_out, workers=args.jobs, cache=cache)
+    if cache is not None:
+        cache.save()
+
+    if args.queue or args.squeue is not None:
+        queued = queue_states(args.squeue)
+        for stem, r in results.items():
+            name = os.path.basename(stem)
+            if name in queued and r['state'] not in ['converged', 'failed']:
+                results[stem] = dict(r, state=queued[name])
+
+    if args.state is not None:
+        wanted = set(args.state.split(','))
+        results = {s: r for s, r in results.items() if r['state'] in wanted}
+
+    counts = Counter(r['state'] for r in results.values())
+    if not args.summary:
+        print(format_table(results))
+    print(', '.join(f'{counts[s]} {s}' for s in STATES if counts[s]) or 'No calculations found.')
+    return 0
@@ -0,0 +1,170 @@
+import csv
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import write_atomic
+
+JOB_ID = re.compile(r'Submitted batch job (\d+)')
+
+# Messages from sbatch that indicate an overloaded or unreachable slurmctld, worth retrying
+TRANSIENT = ['Socket timed out',
+             'Unable to contact slurm controller',
+             'Slurm temporarily unable',
+             'Resource temporarily unavailable',
+             'Connection refused']
+
+
+class RateLimiter:
+    """Spaces out calls from any number of threads to at most rate calls per second."""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        time.sleep(start - now)
+
+
+class QueueThrottle:
+    """Holds back submissions while max_pending or more of the user's jobs are pending in the queue,
+    polling squeue every interval seconds. squeue is a command line printing one line per pending job,
+    so a local stand-in script can be used for testing."""
+    def __init__(self, max_pending, squeue=None, interval=30.0):
+        self.squeue = shlex.split(squeue if squeue is not None else os.environ.get('PYSLURM_SQUEUE', 'squeue --me -h -t PENDING -o %i'))
+        self.max_pending = max_pending
+        self.interval = interval
+        self.free = 0
+        self.lock = threading.Lock()
+
+    def pending(self):
+        """Number of pending jobs, or None if squeue failed."""
+        p = subprocess.run(self.squeue, capture_output=True, text=True)
+        if p.returncode != 0:
+            return None
+        return sum(1 for line in p.stdout.splitlines() if line.strip())
+
+    def wait(self):
+        """Wait for a free place in the queue. Places seen free in one poll are handed out
+        without polling again."""
+        with self.lock:
+            while self.free <= 0:
+                pending = self.pending()
+                if pending is not None:
+                    self.free = self.max_pending - pending
+                if self.free <= 0:
+                    time.sleep(self.interval)
+            self.free -= 1
+
+
+class Submitter:
+    """Submits job files concurrently with a bounded number of sbatch calls in flight,
+    a rate limit and retries with exponential backoff on transient controller errors. With a throttle,
+    every job waits for a free place in the queue before it is submitted.
+
+    sbatch is a command line, so a local stand-in script can be used for testing."""
+    def __init__(self, sbatch=None, concurrency=4, rate=None, retries=3, backoff=1.0, throttle=None):
+        self.sbatch = shlex.split(sbatch if sbatch is not None else os.environ.get('PYSLURM_SBATCH', 'sbatch'))
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.throttle = throttle
+
+    def submit(self, jobfile, options=None):
+        """Submit a single job file from its own directory. Returns a ledger record."""
+        record = {'jobfile': jobfile, 'jobid': None, 'attempts': 0, 'error': None, 'output': ''}
+        cmd = self.sbatch + list(options or []) + [os.path.basename(jobfile)]
+        cwd = os.path.dirname(jobfile) or None
+
+        if self.throttle is not None:
+            self.throttle.wait()
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            record['attempts'] = attempt + 1
+            try:
+                p = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+            except OSError as e:
+                record['error'] = str(e)
+                return record
+
+            record['output'] = p.stdout.strip()
+            match = JOB_ID.search(p.stdout)
+            if p.returncode == 0 and match:
+                record['jobid'] = match.group(1)
+                record['error'] = None
+                return record
+
+            record['error'] = p.stderr.strip() or p.stdout.strip() or f'sbatch exited with {p.returncode}'
+            if not any(t in p.stderr for t in TRANSIENT):
+                return record
+
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+        return record
+
+    def submit_all(self, jobfiles, options=None):
+        """Submit all job files. Returns ledger records in the order of jobfiles."""
+        if len(jobfiles) <= 1 or self.concurrency == 1:
+            return [self.submit(f, options) for f in jobfiles]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(pool.map(lambda f: self.submit(f, options), jobfiles))
+
+
+def write_ledger(path, records):
+    """Record job file -> job ID. CSV ledgers are appended to, JSON ledgers are merged by job file."""
+    fields = ['jobfile', 'jobid', 'attempts', 'error', 'submitted']
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    rows = [{'jobfile': os.path.abspath(r['jobfile']), 'jobid': r['jobid'], 'attempts': r['attempts'],
+             'error': r['error'], 'submitted': stamp} for r in records]
+
+    if path.endswith('.csv'):
+        new = not os.path.exists(path)
+        with open(path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+        return
+
+    ledger = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            ledger = {r['jobfile']: r for r in json.load(f)}
+    for r in rows:
+        ledger[r['jobfile']] = r
+    write_atomic(path, json.dumps(list(ledger.values()), indent=2))
+
+
+def make_submitter(args):
+    throttle = None
+    if args.max_pending is not None:
+        throttle = QueueThrottle(args.max_pending, squeue=args.squeue, interval=args.poll)
+    return Submitter(sbatch=args.sbatch,
+                     concurrency=args.submit_jobs,
+                     rate=args.rate,
+                     retries=args.retries,
+                     throttle=throttle)
+
+
+def submit_jobs(jobfiles, args):
+    """Submit job files according to the submission arguments and write the ledger, if requested."""
+    submitter = make_submitter(args)
+    records = submitter.submit_all(jobfiles)
+    if args.ledger is not None:
+        write_ledger(args.ledger, records)
+    return records
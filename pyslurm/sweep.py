@@ -0,0 +1,246 @@
+import argparse
+import copy
+import glob
+import itertools
+import json
+import os
+import re
+from pathlib import Path
+
+from config import Config
+from jobs import write_atomic
+from layout import LayoutError, check_config, get_clusters
+
+NAME = 'sweep.json'
+
+# Swept options: attribute of Config and prefix in the names of the points
+AXES = [('nodes', 'n'), ('ntasks', 'nt'), ('cpus', 'nc'), ('memory', 'm')]
+
+
+class SweepError(ValueError):
+    pass
+
+
+class ConfigVariant:
+    """A Config with a few attributes overridden. Everything else is read from the shared base
+    configuration rather than copied, so the points of a large sweep only cost their overrides.
+    Methods of Config act on the variant."""
+    __slots__ = ('base', 'overrides')
+
+    def __init__(self, base, **overrides):
+        object.__setattr__(self, 'base', base)
+        object.__setattr__(self, 'overrides', overrides)
+
+    def __getattr__(self, name):
+        if name in self.overrides:
+            return self.overrides[name]
+        attr = getattr(Config, name, None)
+        if callable(attr):
+            return attr.__get__(self)
+        return getattr(self.base, name)
+
+    def __setattr__(self, name, value):
+        self.overrides[name] = value
+
+    def __copy__(self):
+        return ConfigVariant(self.base, **self.overrides)
+
+    def __str__(self):
+        return Config.__str__(self)
+
+    def to_dict(self):
+        d = self.base.to_dict()
+        d.update(self.overrides)
+        d.pop('config', None)
+        return d
+
+
+def parse_axis(spec, memory=False):
+    """Values of a swept option: a comma separated list of values and ranges. A range start:stop[:step]
+    counts up by step (default 1), start:stop:xF multiplies by F. Memory values carry their units,
+    the units of a range are taken from its start."""
+    values = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if ':' not in item:
+            values.append(item)
+            continue
+        parts = item.split(':')
+        if len(parts) not in [2, 3]:
+            raise SweepError(f'Invalid range: {item}')
+        units = ''
+        if memory:
+            m = re.match(r'([0-9]+)([KMGT]?B?)$', parts[0], re.IGNORECASE)
+            units = m.group(2) if m else ''
+            parts = [re.sub(r'[KMGT]?B?$', '', p, flags=re.IGNORECASE) for p in parts[:2]] + parts[2:]
+        try:
+            start, stop = int(parts[0]), int(parts[1])
+            step = parts[2] if len(parts) == 3 else '1'
+            factor = int(step[1:]) if step.lower().startswith('x') else None
+            step = int(step) if factor is None else None
+        except ValueError:
+            raise SweepError(f'Invalid range: {item}')
+        if (factor is not None and factor < 2) or (step is not None and step < 1) or start < 1:
+            raise SweepError(f'Invalid range: {item}')
+        v = start
+        while v <= stop:
+            values.append(f'{v}{units}')
+            v = v * factor if factor is not None else v + step
+    if not values:
+        raise SweepError(f'No values in: {spec}')
+    if memory and not all(v.lower().endswith('b') for v in values):
+        raise SweepError(f'Memory needs units (e.g. 8GB): {spec}')
+    return values
+
+
+def axes_from_args(args):
+    """(attribute, prefix, values) of every swept option."""
+    axes = []
+    for attr, prefix in AXES:
+        spec = getattr(args, f'sweep_{attr}')
+        if spec is not None:
+            axes.append((attr, prefix, parse_axis(spec, memory=attr == 'memory')))
+    return axes
+
+
+def is_sweep(args):
+    return any(getattr(args, f'sweep_{attr}') is not None for attr, _ in AXES)
+
+
+def point_cores(config):
+    """Number of cores requested by a configuration."""
+    if config.layout is not None:
+        return config.layout.ntasks * config.layout.threads
+    threads = int(config.cpus) if config.hybrid else 1
+    return int(config.ntasks) * threads * (int(config.nodes) if config.loc else 1)
+
+
+def prune_reason(config, code):
+    """Why a point does not fit the node shape of its cluster, or None if it does: too many cores or too
+    much memory per node, threads straddling NUMA domains, or Gaussian on more than one node."""
+    try:
+        check_config(config)
+    except LayoutError as e:
+        return str(e)
+    if config.loc and int(config.nodes) > 1 and code == 'gaussian':
+        return 'Gaussian runs on a single node'
+    node = get_clusters().get(config.cluster)
+    if node is not None and config.hybrid:
+        domain = node['cores'] // node['numa']
+        threads = int(config.cpus)
+        if domain % threads and threads % domain:
+            return f'{threads} threads per task do not divide the {domain} cores of a NUMA domain'
+    return None
+
+
+def points(config, axes):
+    """A lightweight configuration per point of the Cartesian product of the axes, with its name.
+    Sweeping nodes requests them explicitly (-L), sweeping CPUs per task implies --hybrid."""
+    names = [a[0] for a in axes]
+    for values in itertools.product(*[a[2] for a in axes]):
+        overrides = dict(zip(names, values))
+        if 'nodes' in overrides:
+            overrides['loc'] = True
+        if 'cpus' in overrides:
+            overrides['hybrid'] = True
+        name = '_'.join(f'{prefix}{v}' for (_, prefix, _), v in zip(axes, values))
+        variant = ConfigVariant(config, **overrides)
+        variant.display_name = f'{config.display_name}_{name}'
+        variant.build_config()
+        yield name, variant
+
+
+def sweep_directory(config, args):
+    dest = Path(args.dest) if args.dest is not None else Path(config.input).parent
+    return dest / f'{config.input_stem}_sweep'
+
+
+def make_sweep(config, args, code):
+    """Yield (name, job, reason) for every point of the sweep, each job in its own directory
+    <dest>/<stem>_sweep/<name>/ with the job file <stem>_<name>.job. With --sweep-prune, points that do not
+    fit the nodes are yielded with job None and the reason, otherwise they raise a LayoutError."""
+    from batch import make_job
+
+    directory = sweep_directory(config, args)
+    point_args = copy.copy(args)
+    for name, variant in points(config, axes_from_args(args)):
+        reason = prune_reason(variant, code) if args.sweep_prune else None
+        if reason is not None:
+            yield name, None, reason
+            continue
+        point_args.dest = str(directory / name)
+        job = make_job(variant, point_args, code=code)
+        job.jobfile = str(directory / name / f'{config.input_stem}_{name}{job.ext}')
+        yield name, job, None
+
+
+def write_index(config, code, records, args):
+    """Record the points of a sweep in <dest>/<stem>_sweep/sweep.json, read by the speedup command."""
+    index = {'stem': config.input_stem, 'code': code, 'ext_out': config.ext_out, 'points': records}
+    path = sweep_directory(config, args) / NAME
+    write_atomic(path, json.dumps(index, indent=1))
+    return path
+
+
+def point_record(name, job):
+    c = job.config
+    return {'name': name, 'nodes': c.nodes if c.loc or c.layout is not None else '1', 'ntasks': c.ntasks,
+            'cpus': c.cpus if c.hybrid else '1', 'memory': c.memory, 'cores': point_cores(c),
+            'jobfile': os.path.basename(job.jobfile)}
+
+
+def find_sweeps(paths):
+    """sweep.json files given, in the sweep directories given, or in the <stem>_sweep directories below them."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        elif os.path.isfile(os.path.join(path, NAME)):
+            yield os.path.join(path, NAME)
+        else:
+            yield from sorted(glob.glob(os.path.join(path, '*_sweep', NAME)))
+
+
+def speedup_table(path):
+    """Speedup and parallel efficiency of every finished point of a sweep, relative to the finished point
+    with the fewest cores."""
+    from outputs import wall_time
+
+    with open(path) as f:
+        index = json.load(f)
+    directory = os.path.dirname(path)
+    rows = []
+    for p in index['points']:
+        seconds = wall_time(os.path.join(directory, p['name']), index['stem'], index['code'], index.get('ext_out', '.out'))
+        rows.append((p, seconds))
+
+    done = [(p, s) for p, s in rows if s is not None]
+    lines = [f'{index["stem"]} ({index["code"]}), {len(done)} of {len(rows)} points finished',
+             f'{"point":<28}{"cores":>7}{"wall":>12}{"speedup":>10}{"efficiency":>12}']
+    ref = min(done, key=lambda r: r[0]['cores']) if done else None
+    for p, seconds in rows:
+        if seconds is None:
+            lines.append(f'{p["name"]:<28}{p["cores"]:>7}{"-":>12}{"-":>10}{"-":>12}')
+            continue
+        speedup = ref[1] / seconds if seconds else float('inf')
+        efficiency = speedup * ref[0]['cores'] / p['cores']
+        lines.append(f'{p["name"]:<28}{p["cores"]:>7}{seconds:>11.1f}s{speedup:>10.2f}{efficiency:>12.1%}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pyslurm.py speedup', description='Speedup and efficiency of the points of sweeps (--sweep-*), from the wall times in their outputs.')
+    parser.add_argument('paths', nargs='*', default=['.'], help='sweep.json files or directories to search (default: .)')
+    args = parser.parse_args(argv)
+
+    found = False
+    for path in find_sweeps(args.paths):
+        if found:
+            print()
+        print(speedup_table(path))
+        found = True
+    if not found:
+        print('No sweeps found.')
+        return 1
+    return 0
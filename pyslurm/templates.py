@@ -0,0 +1,58 @@
+import functools
+import os
+import re
+
+CONFIG = os.environ.get('XDG_CONFIG_HOME', os.path.join(os.path.expanduser('~'), '.config'))
+TEMPLATES = os.environ.get('PYSLURM_TEMPLATES', os.path.join(CONFIG, 'pyslurm', 'templates'))
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+# Sections rendered by the job classes, and per-input values
+FIELDS = {'prologue', 'stage_in', 'run', 'stage_out',
+          'input', 'output', 'stem', 'cluster', 'account', 'nodes', 'ntasks', 'cpus', 'memory', 'timelimit'}
+
+# Body shared by all codes. The prologue (module and environment setup) depends only on
+# cluster and code, everything else is filled in per input.
+DEFAULT = '''
+{{prologue}}
+
+{{stage_in}}
+{{run}}
+
+{{stage_out}}
+
+exit 0'''
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class ScriptTemplate:
+    """Job script body with {{field}} placeholders. The text is split into literal parts and
+    field names once, so rendering is a single join."""
+    def __init__(self, text, source='default template'):
+        self.parts = PLACEHOLDER.split(text)
+        unknown = set(self.parts[1::2]) - FIELDS
+        if unknown:
+            raise TemplateError(f'Unknown field(s) in {source}: {", ".join(sorted(unknown))}')
+
+    def render(self, fields):
+        parts = list(self.parts)
+        parts[1::2] = [str(fields[name]) for name in self.parts[1::2]]
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(code, path=None):
+    """Template for code: the given file, else <templates>/<code>.sh if it exists, else the default."""
+    if path is None:
+        path = os.path.join(TEMPLATES, f'{code}.sh')
+        if not os.path.exists(path):
+            return ScriptTemplate(DEFAULT)
+
+    try:
+        with open(path) as f:
+            return ScriptTemplate(f.read(), source=path)
+    except OSError as e:
+        raise TemplateError(f'Error reading template {path}: {e}')
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import shlex
+import sys
+
+from cli import cli
+
+# Output of a stage read by later stages, as written by MRChemJob to the submit directory
+PRODUCTS = {'guess_orb': '.orbitals', 'guess_check': '.checkpoint'}
+
+
+class WorkflowError(ValueError):
+    pass
+
+
+def load_workflow(path):
+    """Read a workflow description (JSON, or YAML if PyYAML is installed)."""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise WorkflowError(f'{path}: YAML workflows need PyYAML, use JSON otherwise')
+            data = yaml.safe_load(f)
+        else:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise WorkflowError(f'{path}: {e}')
+    if not isinstance(data, dict) or not isinstance(data.get('stages'), dict) or not data['stages']:
+        raise WorkflowError(f'{path}: a workflow needs a mapping of stages')
+    return data
+
+
+def split_options(options):
+    return shlex.split(options) if isinstance(options, str) else [str(o) for o in options or []]
+
+
+class Stage:
+    """One job of a workflow: an input, its pyslurm options, and the stages it runs after.
+    guess_orb and guess_check name stages whose orbitals (checkpoint) the job starts from."""
+    def __init__(self, name, spec, common, root):
+        if 'input' not in spec:
+            raise WorkflowError(f'Stage {name} has no input')
+        self.name = name
+        self.input = os.path.join(root, spec['input'])
+        self.guess = {key: spec[key] for key in PRODUCTS if spec.get(key) is not None}
+        self.after = list(dict.fromkeys(list(spec.get('after', [])) + list(self.guess.values())))
+        self.args = cli().parse_args(split_options(common) + split_options(spec.get('options')) + ['-i', self.input])
+        if self.args.dest is not None and not os.path.isabs(self.args.dest):
+            self.args.dest = os.path.join(root, self.args.dest)
+        self.args.guess_orb_from = self.args.guess_check_from = None
+        self.job = None
+
+
+def order_stages(stages):
+    """Stages sorted such that every stage comes after the stages it depends on."""
+    ordered, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise WorkflowError(f'Dependency cycle: {" -> ".join(path + [name])}')
+        state[name] = 'visiting'
+        for parent in stages[name].after:
+            if parent not in stages:
+                raise WorkflowError(f'Stage {name} depends on unknown stage {parent}')
+            visit(parent, path + [name])
+        state[name] = 'done'
+        ordered.append(stages[name])
+
+    for name in stages:
+        visit(name, [])
+    return ordered
+
+
+def runtime_path(stage, parent, ext):
+    """Shell expression reading the path written by the parent job to <stem><ext> in its submit directory
+    when the stage starts, relative to the submit directory of the stage."""
+    source = os.path.join(os.path.dirname(parent.job.jobfile), parent.job.stem + ext)
+    return f'$(cat ${{SLURM_SUBMIT_DIR}}/{os.path.relpath(source, stage_dest(stage))})'
+
+
+def stage_dest(stage):
+    if stage.args.dest is not None:
+        return stage.args.dest
+    return os.path.dirname(stage.input) or '.'
+
+
+def check_guess(stage, parent, key):
+    job = parent.job
+    if job.code != 'mrchem':
+        raise WorkflowError(f'Stage {stage.name} takes {key} from {parent.name}, which is not an MRChem job')
+    if not (job.store_orbs if key == 'guess_orb' else job.store_chk):
+        raise WorkflowError(f'Stage {parent.name} does not store its {"orbitals" if key == "guess_orb" else "checkpoint"}')
+    if job.orb_store is not None and stage.args.orb_store is None:
+        raise WorkflowError(f'Stage {stage.name} reads orbital store references from {parent.name} and needs --orb-store')
+
+
+def make_stage_job(stage, stages):
+    """Generate the job of a stage. Guess orbitals of earlier stages are read from their .orbitals and
+    .checkpoint files when the job starts, as they only exist once those jobs have finished."""
+    from batch import is_batch, make_job
+    from config import config_from_args
+    from sweep import is_sweep
+
+    args = stage.args
+    if is_batch(args) or is_sweep(args) or args.array or args.farm:
+        raise WorkflowError(f'Stage {stage.name}: workflow stages are single jobs')
+    guesses = {}
+    for key, parent in stage.guess.items():
+        check_guess(stage, stages[parent], key)
+        guesses[key] = runtime_path(stage, stages[parent], PRODUCTS[key])
+
+    config = config_from_args(args)
+    if args.placement:
+        from placement import place_from_args
+        place_from_args(config, args)
+    job = make_job(config, args, init_orbs=guesses.get('guess_orb'), init_check=guesses.get('guess_check'))
+    if guesses and job.code != 'mrchem':
+        raise WorkflowError(f'Stage {stage.name} takes guess orbitals but is not an MRChem job')
+    if args.sync_input:
+        from inputsync import sync_job
+        sync_job(job, args.sync_input)
+    return job
+
+
+def generate(path, force=False):
+    """Generate the job files of a workflow. Returns its stages in dependency order."""
+    from detect import UnknownJonError
+    from layout import LayoutError
+    from placement import PlacementError
+    from templates import TemplateError
+
+    data = load_workflow(path)
+    root = os.path.dirname(path)
+    stages = {name: Stage(name, spec or {}, data.get('options'), root) for name, spec in data['stages'].items()}
+    ordered = order_stages(stages)
+    for stage in ordered:
+        try:
+            stage.job = make_stage_job(stage, stages)
+        except (UnknownJonError, TemplateError, LayoutError, PlacementError) as e:
+            raise WorkflowError(f'Stage {stage.name}: {e}')
+        if os.path.exists(stage.job.jobfile) and not (force or stage.args.force):
+            raise WorkflowError(f'{stage.job.jobfile} exists (use -f to overwrite)')
+    return ordered
+
+
+def submit_workflow(ordered, submitter):
+    """Submit the jobs of a workflow in dependency order, each held by SLURM until the jobs of the stages
+    it runs after completed successfully. Jobs depending on a failed submission are not submitted.
+    Returns ledger records, with the error of the parent for jobs that were not submitted."""
+    ids, records = {}, []
+    for stage in ordered:
+        missing = [p for p in stage.after if ids.get(p) is None]
+        if missing:
+            records.append({'jobfile': stage.job.jobfile, 'jobid': None, 'attempts': 0, 'output': '',
+                            'error': f'not submitted, {", ".join(missing)} failed'})
+            ids[stage.name] = None
+            continue
+        options = []
+        if stage.after:
+            options = [f'--dependency=afterok:{":".join(ids[p] for p in stage.after)}', '--kill-on-invalid-dep=yes']
+        record = submitter.submit(stage.job.jobfile, options)
+        ids[stage.name] = record['jobid']
+        records.append(record)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pyslurm.py workflow', description='Generate the job files of multi-stage workflows (JSON, or YAML with PyYAML) and submit them with SLURM dependencies.')
+    parser.add_argument('workflows', nargs='+', help='Workflow files.')
+    parser.add_argument('-f', '--force', action='store_true', help='Overwrite existing job files.')
+    parser.add_argument('-X', '--execute', action='store_true', help='Submit the jobs, each held until the stages it runs after completed (afterok).')
+    parser.add_argument('--dry-run', action='store_true', help='List the stages in submission order and exit.')
+    parser.add_argument('--sbatch', type=str, help='sbatch command to submit with (default: $PYSLURM_SBATCH or sbatch).')
+    parser.add_argument('--rate', default=5.0, type=float, help='Maximum number of sbatch calls per second.')
+    parser.add_argument('--retries', default=5, type=int, help='Retries on transient controller errors (e.g. socket timeouts).')
+    parser.add_argument('--ledger', type=str, metavar='FILE', help='Record job file -> job ID in a JSON or CSV (.csv) ledger.')
+    parser.add_argument('--max-pending', type=int, metavar='K', help='Hold back submissions while K or more of your jobs are pending (polls squeue).')
+    parser.add_argument('--squeue', type=str, help='Command listing your pending jobs, one per line (default: $PYSLURM_SQUEUE or squeue --me -h -t PENDING -o %%i).')
+    parser.add_argument('--poll', default=30.0, type=float, metavar='S', help='Seconds between squeue polls with --max-pending.')
+    parser.set_defaults(submit_jobs=1)
+    args = parser.parse_args(argv)
+
+    from environment import EnvironmentSchemaError, get_environments
+    try:
+        get_environments()
+        workflows = [(path, generate(path, force=args.force)) for path in args.workflows]
+    except (OSError, WorkflowError, EnvironmentSchemaError) as e:
+        sys.exit(str(e))
+
+    for path, ordered in workflows:
+        print(f'{path}:')
+        for stage in ordered:
+            after = f' after {", ".join(stage.after)}' if stage.after else ''
+            print(f'  {stage.name}: {stage.job.jobfile}{after}')
+    if args.dry_run:
+        return 0
+
+    for _, ordered in workflows:
+        for stage in ordered:
+            stage.job.write()
+    if not args.execute:
+        return 0
+
+    from submit import make_submitter, write_ledger
+    submitter = make_submitter(args)
+    records = []
+    for path, ordered in workflows:
+        records.extend(submit_workflow(ordered, submitter))
+    if args.ledger is not None:
+        write_ledger(args.ledger, [r for r in records if r['attempts']])
+
+    failed = [r for r in records if r['jobid'] is None]
+    for r in records:
+        print(f'{r["jobfile"]}: {r["jobid"] if r["jobid"] is not None else "failed (" + r["error"] + ")"}')
+    print(f'Submitted {len(records) - len(failed)} of {len(records)} jobs')
+    return 1 if failed else 0